@@ -0,0 +1,274 @@
+"""Cold storage for old messages: retention policies and archive segments.
+
+Messages that fall outside a room's retention policy are moved out of the
+``Message`` table in batches. Each batch becomes one immutable segment
+file under ``CHAT_ARCHIVE_DIR/<room id>/``, plus an ``ArchiveSegment`` row
+cataloguing it. A room's archive only ever grows by new segments.
+
+A segment is a magic header followed by zlib-compressed blocks of up to
+``ARCHIVE_BLOCK_SIZE`` messages, each block a JSON array of
+``[id, username, content, iso timestamp]`` rows in id order. Its ``.idx``
+file holds one fixed-size entry per block (first id, offset, length,
+message count), so a reader can binary search a memory-mapped index and
+decompress only the blocks it needs.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .metrics import DB_SECONDS, timed
+from .models import ArchiveSegment, Message, Room
+
+logger = logging.getLogger(__name__)
+
+# Constants
+ARCHIVE_DIR = str(getattr(settings, 'CHAT_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'archive')))
+ARCHIVE_BATCH_SIZE = getattr(settings, 'CHAT_ARCHIVE_BATCH_SIZE', 10000)  # messages per segment
+ARCHIVE_BLOCK_SIZE = 256  # messages per compressed block
+DEFAULT_RETENTION_DAYS = getattr(settings, 'CHAT_RETENTION_DAYS', None)
+DEFAULT_RETENTION_MESSAGES = getattr(settings, 'CHAT_RETENTION_MESSAGES', None)
+MAX_OPEN_SEGMENTS = 64
+DELETE_CHUNK_SIZE = 500  # stays under SQLite's bound parameter limit
+
+SEGMENT_MAGIC = b'CHATSEG1'
+INDEX_MAGIC = b'CHATIDX1'
+INDEX_ENTRY = struct.Struct('<QQII')  # first id, offset, compressed length, messages
+
+ArchivedRow = Tuple[int, str, str, datetime]  # id, username, content, timestamp
+
+
+def room_archive_dir(room_id: int) -> str:
+    return os.path.join(ARCHIVE_DIR, str(room_id))
+
+
+def write_segment(room_id: int, rows: Sequence[ArchivedRow]) -> Dict:
+    """Write ``rows`` (in id order) as a new segment; returns its catalog fields."""
+    directory = room_archive_dir(room_id)
+    os.makedirs(directory, exist_ok=True)
+    name = f'{rows[0][0]}-{rows[-1][0]}'
+    segment_path = os.path.join(directory, f'{name}.seg')
+    index_path = os.path.join(directory, f'{name}.idx')
+
+    with open(segment_path + '.tmp', 'wb') as segment, open(index_path + '.tmp', 'wb') as index:
+        segment.write(SEGMENT_MAGIC)
+        index.write(INDEX_MAGIC)
+        offset = len(SEGMENT_MAGIC)
+        for start in range(0, len(rows), ARCHIVE_BLOCK_SIZE):
+            block = rows[start:start + ARCHIVE_BLOCK_SIZE]
+            payload = zlib.compress(json.dumps(
+                [[message_id, username, content, timestamp.isoformat()]
+                 for message_id, username, content, timestamp in block],
+                separators=(',', ':'),
+            ).encode())
+            segment.write(payload)
+            index.write(INDEX_ENTRY.pack(block[0][0], offset, len(payload), len(block)))
+            offset += len(payload)
+        for handle in (segment, index):
+            handle.flush()
+            os.fsync(handle.fileno())
+
+    # The segment is in place before its index, and both before the catalog row
+    os.replace(segment_path + '.tmp', segment_path)
+    os.replace(index_path + '.tmp', index_path)
+
+    timestamps = [row[3] for row in rows]
+    return {
+        'path': os.path.relpath(segment_path, ARCHIVE_DIR),
+        'first_id': rows[0][0],
+        'last_id': rows[-1][0],
+        'first_timestamp': min(timestamps),
+        'last_timestamp': max(timestamps),
+        'message_count': len(rows),
+        'size_bytes': offset,
+    }
+
+
+class SegmentReader:
+    """Read-only view of one segment and its index through ``mmap``."""
+
+    def __init__(self, segment_path: str):
+        index_path = segment_path[:-len('.seg')] + '.idx'
+        with open(segment_path, 'rb') as segment, open(index_path, 'rb') as index:
+            self._data = mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ)
+            self._index = mmap.mmap(index.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._data[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC or self._index[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            raise ValueError(f"{segment_path} is not a chat archive segment")
+        self.block_count = (len(self._index) - len(INDEX_MAGIC)) // INDEX_ENTRY.size
+
+    def _entry(self, block: int) -> Tuple[int, int, int, int]:
+        return INDEX_ENTRY.unpack_from(self._index, len(INDEX_MAGIC) + block * INDEX_ENTRY.size)
+
+    def block_before(self, message_id: int) -> int:
+        """Index of the last block starting below ``message_id``, or -1."""
+        low, high = 0, self.block_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._entry(middle)[0] < message_id:
+                low = middle + 1
+            else:
+                high = middle
+        return low - 1
+
+    def read_block(self, block: int) -> List[ArchivedRow]:
+        _, offset, length, _ = self._entry(block)
+        return [
+            (message_id, username, content, datetime.fromisoformat(timestamp))
+            for message_id, username, content, timestamp in json.loads(zlib.decompress(self._data[offset:offset + length]))
+        ]
+
+
+_readers: 'OrderedDict[str, SegmentReader]' = OrderedDict()
+_readers_lock = threading.Lock()
+
+
+def open_segment(path: str) -> SegmentReader:
+    """Return a cached reader for a segment path relative to ``ARCHIVE_DIR``."""
+    with _readers_lock:
+        reader = _readers.get(path)
+        if reader is not None:
+            _readers.move_to_end(path)
+            return reader
+    reader = SegmentReader(os.path.join(ARCHIVE_DIR, path))
+    with _readers_lock:
+        _readers[path] = reader
+        # Evicted maps are closed when the last reader using them lets go
+        while len(_readers) > MAX_OPEN_SEGMENTS:
+            _readers.popitem(last=False)
+    return reader
+
+
+class MessageArchive:
+    """Reads archived messages back, newest-first for history or in id order for exports."""
+
+    @staticmethod
+    def has_archive(room_id: int) -> bool:
+        # A filesystem check, so rooms that were never archived cost no query
+        return os.path.isdir(room_archive_dir(room_id))
+
+    @staticmethod
+    @timed(DB_SECONDS, operation='archive_read')
+    def read_before(room_id: int, before: Optional[int], count: int) -> List[Dict]:
+        """Up to ``count`` archived messages older than ``before``, newest first.
+
+        Rows are shaped like ``Message.values('id', 'username', 'content', 'timestamp')``.
+        Segments normally cover disjoint id ranges, but a message flushed
+        late can land in a later segment, so segments are merged by id.
+        """
+        segments = ArchiveSegment.objects.filter(room_id=room_id)
+        if before is not None:
+            segments = segments.filter(first_id__lt=before)
+
+        collected: List[ArchivedRow] = []
+        for path, last_id in segments.order_by('-last_id').values_list('path', 'last_id'):
+            if len(collected) >= count and last_id < collected[-1][0]:
+                break
+            reader = open_segment(path)
+            block = reader.block_count - 1 if before is None else reader.block_before(before)
+            found = 0
+            while block >= 0 and found < count:
+                rows = [row for row in reader.read_block(block) if before is None or row[0] < before]
+                collected.extend(rows)
+                found += len(rows)
+                block -= 1
+            collected.sort(key=lambda row: row[0], reverse=True)
+            del collected[count:]
+
+        return [
+            {'id': message_id, 'username': username, 'content': content, 'timestamp': timestamp}
+            for message_id, username, content, timestamp in collected
+        ]
+
+    @staticmethod
+    def iter_rows(room_id: int, after: Optional[int] = None) -> Iterator[ArchivedRow]:
+        """Archived messages with an id above ``after``, segment by segment in id order."""
+        segments = ArchiveSegment.objects.filter(room_id=room_id)
+        if after is not None:
+            segments = segments.filter(last_id__gt=after)
+        for path in list(segments.order_by('last_id').values_list('path', flat=True)):
+            reader = open_segment(path)
+            block = 0 if after is None else max(0, reader.block_before(after + 1))
+            for block in range(block, reader.block_count):
+                for row in reader.read_block(block):
+                    if after is None or row[0] > after:
+                        yield row
+
+
+class RetentionPolicy:
+    """Decides which of a room's messages are old enough to archive."""
+
+    # Larger than any message id: "archive everything"
+    ALL = 2 ** 63 - 1
+
+    @staticmethod
+    def limits(room: Room) -> Tuple[Optional[int], Optional[int]]:
+        days = room.retention_days if room.retention_days is not None else DEFAULT_RETENTION_DAYS
+        messages = room.retention_messages if room.retention_messages is not None else DEFAULT_RETENTION_MESSAGES
+        return days, messages
+
+    @staticmethod
+    def boundary(room: Room, now: Optional[datetime] = None) -> Optional[int]:
+        """Messages with an id below this are archived; None if the room keeps everything hot.
+
+        A message is archived once it is outside any configured limit, so
+        both limits bound the hot table. Archiving always takes a prefix in
+        id order, which keeps hot and archived id ranges from interleaving.
+        """
+        days, messages = RetentionPolicy.limits(room)
+        if days is None and messages is None:
+            return None
+
+        boundaries = []
+        if days is not None:
+            cutoff = (now or timezone.now()) - timedelta(days=days)
+            first_recent = (
+                Message.objects.filter(room_id=room.id, timestamp__gte=cutoff)
+                .order_by('timestamp', 'id').values_list('id', flat=True).first()
+            )
+            boundaries.append(RetentionPolicy.ALL if first_recent is None else first_recent)
+        if messages is not None:
+            oldest_kept = (
+                Message.objects.filter(room_id=room.id)
+                .order_by('-id').values_list('id', flat=True)[messages:messages + 1].first()
+            )
+            boundaries.append(0 if oldest_kept is None else oldest_kept + 1)
+        return max(boundaries)
+
+
+def archive_room(room: Room, batch_size: int = ARCHIVE_BATCH_SIZE, now: Optional[datetime] = None,
+                 dry_run: bool = False) -> int:
+    """Move a room's messages outside its retention policy into segments; returns how many."""
+    boundary = RetentionPolicy.boundary(room, now)
+    if not boundary:
+        return 0
+    eligible = Message.objects.filter(room_id=room.id, id__lt=boundary)
+    if dry_run:
+        return eligible.count()
+
+    archived = 0
+    while True:
+        rows = list(
+            eligible.order_by('id').values_list('id', 'username', 'content', 'timestamp')[:max(1, batch_size)]
+        )
+        if not rows:
+            return archived
+
+        segment = write_segment(room.id, rows)
+        ids = [row[0] for row in rows]
+        with transaction.atomic():
+            ArchiveSegment.objects.create(room_id=room.id, **segment)
+            # Delete exactly what was written, never a range that could hold a late arrival
+            for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+                Message.objects.filter(id__in=ids[start:start + DELETE_CHUNK_SIZE]).delete()
+        archived += len(rows)
+        logger.info(f"Archived {len(rows)} messages from room {room.code} to {segment['path']}")
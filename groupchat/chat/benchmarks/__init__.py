@@ -0,0 +1,72 @@
+"""Benchmark suites run through ``manage.py benchmark <suite>``.
+
+Each suite module exposes ``add_arguments(parser)`` and ``run(options)``;
+``run`` returns a JSON-serializable dict of results, with a ``failures``
+list when the suite checks budgets.
+"""
+import json
+import platform
+import sys
+from contextlib import contextmanager
+from typing import Dict, List, Sequence
+
+import django
+
+SUITES = {
+    'database': 'chat.benchmarks.database',
+    'fanout': 'chat.benchmarks.fanout',
+    'protocol': 'chat.benchmarks.protocol',
+    'views': 'chat.benchmarks.views',
+    'websocket': 'chat.benchmarks.websocket',
+}
+
+
+def percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted sequence."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def describe_latencies(samples: List[float]) -> Dict[str, float]:
+    """Summarize latency samples in milliseconds."""
+    samples = sorted(samples)
+    if not samples:
+        return {'count': 0}
+    return {
+        'count': len(samples),
+        'mean': round(sum(samples) / len(samples), 3),
+        'p50': round(percentile(samples, 0.50), 3),
+        'p90': round(percentile(samples, 0.90), 3),
+        'p99': round(percentile(samples, 0.99), 3),
+        'max': round(samples[-1], 3),
+    }
+
+
+def environment() -> Dict[str, str]:
+    """Versions that matter when comparing results between releases."""
+    import channels
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'django': django.get_version(),
+        'channels': channels.__version__,
+        'platform': sys.platform,
+    }
+
+
+@contextmanager
+def scratch_database(verbosity: int = 0):
+    """Run against a throwaway test database instead of the real one."""
+    from django.test.utils import setup_databases, teardown_databases
+
+    config = setup_databases(verbosity, interactive=False, aliases={'default'})
+    try:
+        yield
+    finally:
+        teardown_databases(config, verbosity)
+
+
+def dump_results(results: Dict) -> str:
+    return json.dumps(results, indent=2, sort_keys=True)
@@ -0,0 +1,157 @@
+"""Message insert throughput under each database profile.
+
+Every profile gets its own throwaway database, migrated like the real one
+(including the search index triggers). Writer threads then insert
+messages concurrently, each batch in one transaction that also bumps the
+room's counters, the way the write-behind queue does. A batch size of 1
+models one transaction per message. Failed transactions are counted
+rather than retried, so "database is locked" shows up as errors.
+
+``sqlite-rollback`` is SQLite as Django configures it out of the box,
+for comparison. ``postgres`` uses the ``POSTGRES_*`` and
+``DATABASE_POOL_SIZE`` environment variables and needs a server that
+allows creating the test database.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.db.models import F
+
+from groupchat.database import postgres_database, sqlite_database
+
+from . import describe_latencies, environment
+
+PROFILES = {
+    'sqlite-rollback': lambda path: sqlite_database(
+        path, journal_mode='DELETE', synchronous='FULL', busy_timeout=5, mmap_size=0, transaction_mode=None,
+    ),
+    'sqlite': lambda path: sqlite_database(path),
+    'postgres': lambda path: postgres_database(),
+}
+
+
+def add_arguments(parser):
+    parser.add_argument('--profiles', default='sqlite-rollback,sqlite',
+                        help=f"Comma-separated profiles to compare, from {', '.join(PROFILES)}")
+    parser.add_argument('--threads', type=int, default=8, help="Concurrent writer threads")
+    parser.add_argument('--messages', type=int, default=2000, help="Messages inserted per thread")
+    parser.add_argument('--batch-sizes', default='1,50',
+                        help="Comma-separated messages per transaction to measure")
+
+
+def open_profile(name: str, directory: str) -> str:
+    """Register a database alias for ``name`` and create its test database."""
+    alias = f'benchmark_{name.replace("-", "_")}'
+    config = PROFILES[name](os.path.join(directory, f'{alias}.sqlite3'))
+    if config['ENGINE'].endswith('sqlite3'):
+        # A file, not the in-memory default, so journaling settings apply
+        config['TEST'] = {'NAME': config['NAME']}
+    settings.DATABASES[alias] = config
+    connections.settings[alias] = connections.configure_settings({**connections.settings, alias: config})[alias]
+    connections[alias].creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    return alias
+
+
+def close_profile(alias: str) -> None:
+    connection = connections[alias]
+    test_name = connection.settings_dict['NAME']
+    connection.creation.destroy_test_db(test_name, verbosity=0)
+    del connections[alias]
+    del settings.DATABASES[alias]
+
+
+def write_messages(alias: str, room_id: int, count: int, batch_size: int, start: threading.Barrier,
+                   latencies: List[float], errors: List[str]) -> None:
+    from chat.models import Message, Room
+    from chat.persistence import message_ids
+
+    start.wait()
+    try:
+        for offset in range(0, count, batch_size):
+            now = datetime.now(timezone.utc)
+            batch = [
+                Message(id=message_ids.next_id(), room_id=room_id, username='bench',
+                        content=f'benchmark message {offset + index}', timestamp=now)
+                for index in range(min(batch_size, count - offset))
+            ]
+            started = time.perf_counter()
+            try:
+                with transaction.atomic(using=alias):
+                    Message.objects.using(alias).bulk_create(batch)
+                    Room.objects.using(alias).filter(pk=room_id).update(
+                        message_count=F('message_count') + len(batch), last_message_at=now,
+                    )
+            except DatabaseError as e:
+                errors.append(str(e))
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+    finally:
+        connections[alias].close()
+
+
+def measure(alias: str, threads: int, messages: int, batch_size: int) -> Dict:
+    from chat.models import Message, Room
+
+    room = Room.objects.using(alias).create(code=f'BENCH{batch_size}', name='Insert benchmark')
+    start = threading.Barrier(threads + 1)
+    latencies: List[float] = []
+    errors: List[str] = []
+    workers = [
+        threading.Thread(target=write_messages, args=(alias, room.pk, messages, batch_size, start, latencies, errors))
+        for _ in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    start.wait()
+    started = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    written = Message.objects.using(alias).filter(room_id=room.pk).count()
+    return {
+        'batch_size': batch_size,
+        'messages_written': written,
+        'messages_per_second': round(written / elapsed, 1) if elapsed else 0.0,
+        'failed_transactions': len(errors),
+        'first_error': errors[0] if errors else None,
+        'transaction_ms': describe_latencies(latencies),
+        'seconds': round(elapsed, 3),
+    }
+
+
+def run(options: Dict) -> Dict:
+    names = [name.strip() for name in options['profiles'].split(',') if name.strip()]
+    unknown = [name for name in names if name not in PROFILES]
+    if unknown:
+        raise ValueError(f"Unknown profiles {unknown}; expected some of {list(PROFILES)}")
+    batch_sizes = [max(1, int(size)) for size in options['batch_sizes'].split(',') if size.strip()]
+
+    results = {
+        'suite': 'database',
+        'environment': environment(),
+        'threads': options['threads'],
+        'messages_per_thread': options['messages'],
+        'profiles': {},
+    }
+    directory = tempfile.mkdtemp(prefix='chat-db-benchmark-')
+    try:
+        for name in names:
+            alias = open_profile(name, directory)
+            try:
+                results['profiles'][name] = {
+                    'vendor': connections[alias].vendor,
+                    'runs': [measure(alias, options['threads'], options['messages'], size) for size in batch_sizes],
+                }
+            finally:
+                close_profile(alias)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
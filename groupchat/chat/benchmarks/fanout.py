@@ -0,0 +1,209 @@
+"""CPU cost of one broadcast as the room grows.
+
+Two measurements per room size and wire format:
+
+- ``handlers``: only the encoding done by the room's consumers for one
+  broadcast, re-encoding per consumer (as before pre-encoded broadcasts)
+  against encoding once and forwarding the shared frame.
+- ``end_to_end``: real ``ChatConsumer`` instances on the in-memory
+  channel layer, from one client's send until every member has the frame.
+  Clients only count frames, so their decoding is not in the numbers, but
+  everything else in the process is, including the channel layer's
+  per-recipient copy of the event.
+"""
+import asyncio
+import json
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.test import override_settings
+
+from chat.presence import presence_batcher
+from chat.protocol import MSGPACK_AVAILABLE, MSGPACK_SUBPROTOCOL, JsonCodec, MsgpackCodec, shared_frames
+
+from . import describe_latencies, environment, scratch_database
+from .websocket import CONNECT_TIMEOUT, DRAIN_TIMEOUT, channel_layer_settings
+
+if MSGPACK_AVAILABLE:
+    import msgpack
+
+CODECS = {'json': JsonCodec, 'msgpack': MsgpackCodec}
+SPEAKERS = 10  # distinct senders in the handler measurement
+
+
+def parse_sizes(value: str) -> List[int]:
+    return [int(size) for size in value.split(',') if size]
+
+
+def add_arguments(parser):
+    parser.add_argument('--room-sizes', type=parse_sizes, default=[10, 100, 500],
+                        help="Comma-separated members per room, e.g. 10,100,500")
+    parser.add_argument('--broadcasts', type=int, default=50, help="Broadcasts timed per room size")
+    parser.add_argument('--formats', default='json,msgpack', help="Comma-separated wire formats to measure")
+    parser.add_argument('--skip-end-to-end', action='store_true', help="Only measure handler encoding")
+
+
+def make_payload(index: int) -> Dict:
+    return {
+        'id': (1 << 45) + index,
+        'message': f'fan-out benchmark message number {index} with a typical amount of text',
+        'username': f'bench{index % SPEAKERS}',
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def encode_per_consumer(codec, payload: Dict):
+    """What each consumer did before broadcasts carried a pre-encoded frame."""
+    if isinstance(codec, MsgpackCodec):
+        return msgpack.packb(codec.compact_message(payload))
+    return json.dumps(payload)
+
+
+def measure_handlers(fmt: str, size: int, broadcasts: int) -> Dict:
+    results = {}
+    for mode in ('encode_per_consumer', 'encode_once'):
+        codecs = [CODECS[fmt]() for _ in range(size)]
+        payloads = [make_payload(index) for index in range(broadcasts)]
+        started = time.process_time()
+        for payload in payloads:
+            if mode == 'encode_per_consumer':
+                for codec in codecs:
+                    encode_per_consumer(codec, payload)
+            else:
+                frame = json.dumps(payload)
+                for codec in codecs:
+                    codec.encode_message(payload, encoded=frame)
+        elapsed = time.process_time() - started
+        results[mode] = {
+            'cpu_us_per_broadcast': round(elapsed / broadcasts * 1e6, 1),
+            'cpu_us_per_delivery': round(elapsed / broadcasts / size * 1e6, 3),
+        }
+    saved = results['encode_per_consumer']['cpu_us_per_broadcast'] - results['encode_once']['cpu_us_per_broadcast']
+    results['cpu_saved_pct'] = round(100 * saved / results['encode_per_consumer']['cpu_us_per_broadcast'], 1)
+    return results
+
+
+class FanoutRoom:
+    """A room full of connected clients that only count the frames they get."""
+
+    def __init__(self, application, room_code: str, size: int, fmt: str):
+        subprotocols = [MSGPACK_SUBPROTOCOL] if fmt == 'msgpack' else None
+        self.communicators = [
+            WebsocketCommunicator(
+                application, f'/ws/chat/{room_code}/?username=fan{index}', subprotocols=subprotocols
+            )
+            for index in range(size)
+        ]
+        self.readers: List[asyncio.Task] = []
+        self.received = 0
+        self.target = 0
+        self.done = asyncio.Event()
+
+    async def connect(self) -> None:
+        for communicator in self.communicators:
+            connected, _ = await communicator.connect(timeout=CONNECT_TIMEOUT)
+            if not connected:
+                raise RuntimeError("Benchmark client could not connect")
+        # Announce the joins now rather than in the middle of the timed broadcasts
+        await presence_batcher.flush()
+        await asyncio.sleep(0.1)
+        # Discard presence and history frames from the joins
+        for communicator in self.communicators:
+            while not communicator.output_queue.empty():
+                communicator.output_queue.get_nowait()
+        self.readers = [asyncio.create_task(self._read(communicator)) for communicator in self.communicators]
+
+    async def _read(self, communicator) -> None:
+        queue = communicator.output_queue
+        while True:
+            frame = await queue.get()
+            if frame['type'] != 'websocket.send':
+                return
+            self.received += 1
+            if self.received >= self.target:
+                self.done.set()
+
+    async def broadcast(self, sender: int, text: str) -> float:
+        self.target = self.received + len(self.communicators)
+        self.done.clear()
+        started = time.perf_counter()
+        await self.communicators[sender].send_to(
+            text_data=json.dumps({'message': text, 'username': f'fan{sender}'})
+        )
+        await asyncio.wait_for(self.done.wait(), timeout=DRAIN_TIMEOUT)
+        return (time.perf_counter() - started) * 1000
+
+    async def close(self) -> None:
+        for reader in self.readers:
+            reader.cancel()
+        await asyncio.gather(
+            *(communicator.disconnect(timeout=CONNECT_TIMEOUT) for communicator in self.communicators),
+            return_exceptions=True,
+        )
+
+
+@sync_to_async
+def create_room(room_code: str) -> None:
+    from chat.models import Room
+    Room.objects.get_or_create(code=room_code, defaults={'name': room_code})
+
+
+async def measure_end_to_end(fmt: str, size: int, broadcasts: int) -> Dict:
+    from chat.persistence import message_writer
+    from groupchat.asgi import application
+
+    room_code = f'FAN{fmt[0].upper()}{size:05d}'
+    await create_room(room_code)
+    room = FanoutRoom(application, room_code, size, fmt)
+    await room.connect()
+    hits_before = shared_frames.stats()['hits']
+    latencies = []
+    try:
+        started = time.process_time()
+        for index in range(broadcasts):
+            # Rotate senders so no single client hits its rate limit
+            latencies.append(await room.broadcast(index % size, f'fanout {index}'))
+        elapsed = time.process_time() - started
+    finally:
+        await room.close()
+        await message_writer.flush()
+
+    return {
+        'cpu_ms_per_broadcast': round(elapsed / broadcasts * 1000, 3),
+        'cpu_us_per_delivery': round(elapsed / broadcasts / size * 1e6, 2),
+        'shared_frame_hits': shared_frames.stats()['hits'] - hits_before,
+        'latency_ms': describe_latencies(latencies),
+    }
+
+
+def run(options: Dict) -> Dict:
+    formats = [fmt for fmt in options['formats'].split(',') if fmt]
+    if not MSGPACK_AVAILABLE and 'msgpack' in formats:
+        formats.remove('msgpack')
+
+    results = {}
+    for fmt in formats:
+        results[fmt] = {
+            size: {'handlers': measure_handlers(fmt, size, options['broadcasts'])}
+            for size in options['room_sizes']
+        }
+
+    if not options['skip_end_to_end']:
+        with override_settings(CHANNEL_LAYERS=channel_layer_settings('memory', None)):
+            with scratch_database(options.get('verbosity', 0)):
+                for fmt in formats:
+                    for size in options['room_sizes']:
+                        results[fmt][size]['end_to_end'] = asyncio.run(
+                            measure_end_to_end(fmt, size, options['broadcasts'])
+                        )
+
+    config = {key: options[key] for key in ('room_sizes', 'broadcasts', 'skip_end_to_end')}
+    return {
+        'suite': 'fanout',
+        'config': {**config, 'formats': formats},
+        'environment': environment(),
+        'formats': results,
+    }
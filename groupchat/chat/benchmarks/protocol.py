@@ -0,0 +1,92 @@
+"""Bytes per message and encode/decode cost of each wire format.
+
+Encodes a synthetic stream of broadcasts the way one connection would
+receive them, so username interning in the binary format is measured
+over a realistic run rather than per isolated message.
+"""
+import random
+import string
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+from chat.protocol import MSGPACK_AVAILABLE, JsonCodec, MsgpackCodec, shared_frames
+
+from . import environment
+
+
+def add_arguments(parser):
+    parser.add_argument('--messages', type=int, default=10000, help="Broadcasts in the stream")
+    parser.add_argument('--users', type=int, default=50, help="Distinct usernames in the room")
+    parser.add_argument('--message-length', type=int, default=60, help="Average characters per message")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed passes; the fastest is reported")
+    parser.add_argument('--seed', type=int, default=2303)
+
+
+def make_stream(messages: int, users: int, message_length: int, seed: int) -> List[Dict]:
+    rng = random.Random(seed)
+    usernames = [
+        ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 12))) for _ in range(max(1, users))
+    ]
+    alphabet = string.ascii_letters + '      '
+    started = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    base_id = 1 << 45
+    return [
+        {
+            'id': base_id + index * 4096,
+            'message': ''.join(rng.choices(alphabet, k=max(1, int(rng.gauss(message_length, message_length / 3))))),
+            'username': rng.choice(usernames),
+            'timestamp': (started + timedelta(milliseconds=index * 250)).isoformat(),
+        }
+        for index in range(messages)
+    ]
+
+
+def measure(codec_factory, stream: List[Dict], repeat: int) -> Dict:
+    best_encode = best_decode = float('inf')
+    frames = []
+    for _ in range(max(1, repeat)):
+        codec = codec_factory()
+        # Every pass encodes each broadcast for the first time in the process
+        shared_frames.clear()
+        started = time.perf_counter()
+        frames = [codec.encode_messages([message]) for message in stream]
+        best_encode = min(best_encode, time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for frame in frames:
+            if isinstance(frame, bytes):
+                codec.decode(None, frame)
+            else:
+                codec.decode(frame, None)
+        best_decode = min(best_decode, time.perf_counter() - started)
+
+    # Wire size: text frames go out as UTF-8
+    sizes = [len(frame) if isinstance(frame, bytes) else len(frame.encode()) for frame in frames]
+    history = codec_factory().encode({
+        'type': 'history', 'messages': stream[-20:], 'has_more': True, 'next_before': stream[-20]['id'],
+    })
+    return {
+        'bytes_per_message': round(sum(sizes) / len(sizes), 1),
+        'total_bytes': sum(sizes),
+        'encode_us_per_message': round(best_encode / len(stream) * 1e6, 3),
+        'decode_us_per_message': round(best_decode / len(stream) * 1e6, 3),
+        'history_frame_bytes': len(history) if isinstance(history, bytes) else len(history.encode()),
+    }
+
+
+def run(options: Dict) -> Dict:
+    stream = make_stream(options['messages'], options['users'], options['message_length'], options['seed'])
+    formats = {'json': measure(JsonCodec, stream, options['repeat'])}
+    if MSGPACK_AVAILABLE:
+        formats['msgpack'] = measure(MsgpackCodec, stream, options['repeat'])
+        formats['msgpack']['bytes_saved_pct'] = round(
+            100 * (1 - formats['msgpack']['total_bytes'] / formats['json']['total_bytes']), 1
+        )
+
+    return {
+        'suite': 'protocol',
+        'config': {key: options[key] for key in ('messages', 'users', 'message_length', 'repeat', 'seed')},
+        'environment': environment(),
+        'formats': formats,
+    }
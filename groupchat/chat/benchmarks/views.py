@@ -0,0 +1,162 @@
+"""Scaling benchmark for the HTTP views, with per-view query budgets.
+
+Seeds a throwaway SQLite database at each requested scale, then measures
+query count, wall time and traced allocations for each view. A view that
+runs more queries than its budget is reported as a failure, so the
+command exits non-zero when a change reintroduces per-room queries.
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from datetime import timedelta
+from typing import Dict, List
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import describe_latencies, environment, scratch_database
+
+# Queries allowed per request, independent of how many rooms exist
+QUERY_BUDGETS = {
+    'home': 2,
+    'browse_rooms': 2,
+    'browse_rooms_active': 2,
+    'chat_room': 7,
+    'get_room_info': 1,
+}
+
+
+def add_arguments(parser):
+    parser.add_argument('--scales', default='10,100,1000',
+                        help="Comma-separated numbers of public rooms to seed")
+    parser.add_argument('--users', type=int, default=200, help="Users shared between the rooms")
+    parser.add_argument('--members-per-room', type=int, default=5)
+    parser.add_argument('--messages-per-room', type=int, default=20)
+    parser.add_argument('--iterations', type=int, default=20, help="Timed requests per view")
+    parser.add_argument('--budget', action='append', default=[], type=parse_budget, metavar='VIEW=QUERIES',
+                        help="Override a view's query budget, e.g. --budget home=3")
+
+
+def seed(rooms: int, users: int, members_per_room: int, messages_per_room: int) -> None:
+    from chat.models import Message, Room
+
+    Message.objects.all().delete()
+    Room.objects.all().delete()
+    User.objects.all().delete()
+
+    users = max(users, members_per_room, 1)
+    user_objs = User.objects.bulk_create([User(username=f'user{index}') for index in range(users)])
+    now = timezone.now()
+    room_objs = Room.objects.bulk_create([
+        Room(
+            code=f'R{index:07d}',
+            name=f'Room {index}',
+            member_count=members_per_room,
+            message_count=messages_per_room,
+            last_message_at=now - timedelta(seconds=index) if messages_per_room else None,
+        )
+        for index in range(rooms)
+    ])
+
+    Membership = Room.users.through
+    Membership.objects.bulk_create([
+        Membership(room_id=room.pk, user_id=user_objs[(index * members_per_room + offset) % users].pk)
+        for index, room in enumerate(room_objs)
+        for offset in range(members_per_room)
+    ], batch_size=5000, ignore_conflicts=True)
+
+    Message.objects.bulk_create([
+        Message(
+            room_id=room.pk,
+            username=f'user{(index + offset) % users}',
+            content=f'message {offset} in room {index}',
+            timestamp=now - timedelta(seconds=index, milliseconds=messages_per_room - offset),
+        )
+        for index, room in enumerate(room_objs)
+        for offset in range(messages_per_room)
+    ], batch_size=5000)
+
+
+def view_urls(room_code: str) -> Dict[str, str]:
+    return {
+        'home': '/',
+        'browse_rooms': '/browse-rooms/?page=2',
+        'browse_rooms_active': '/browse-rooms/?sort=active&page=2',
+        'chat_room': f'/chat/{room_code}/?username=user0',
+        'get_room_info': f'/room/{room_code}/info/',
+    }
+
+
+def measure(client: Client, url: str, iterations: int) -> Dict:
+    # The first request compiles templates and fills caches
+    response = client.get(url)
+    if response.status_code != 200:
+        raise RuntimeError(f"GET {url} returned {response.status_code}")
+
+    with CaptureQueriesContext(connection) as captured:
+        client.get(url)
+    # Read it now: later requests reset the connection's query log
+    queries = len(captured)
+
+    timings: List[float] = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        client.get(url)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    gc.collect()
+    tracemalloc.start()
+    client.get(url)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'queries': queries,
+        'time_ms': describe_latencies(timings),
+        'peak_allocated_bytes': peak,
+    }
+
+
+def parse_budget(value: str) -> tuple:
+    view, _, queries = value.partition('=')
+    if view not in QUERY_BUDGETS or not queries.isdigit():
+        raise argparse.ArgumentTypeError(f"expected one of {sorted(QUERY_BUDGETS)}=N, got {value!r}")
+    return view, int(queries)
+
+
+def run(options: Dict) -> Dict:
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    budgets = {**QUERY_BUDGETS, **dict(options['budget'])}
+    scales = [int(scale) for scale in options['scales'].split(',') if scale.strip()]
+    results = {'suite': 'views', 'environment': environment(), 'budgets': budgets, 'scales': [], 'failures': []}
+
+    setup_test_environment()
+    try:
+        with scratch_database(options.get('verbosity', 0)):
+            client = Client()
+            for rooms in scales:
+                seed(rooms, options['users'], options['members_per_room'], options['messages_per_room'])
+                scale = {
+                    'rooms': rooms,
+                    'users': options['users'],
+                    'members_per_room': options['members_per_room'],
+                    'messages_per_room': options['messages_per_room'],
+                    'views': {},
+                }
+                for view, url in view_urls('R0000000').items():
+                    scale['views'][view] = stats = measure(client, url, options['iterations'])
+                    if stats['queries'] > budgets[view]:
+                        results['failures'].append(
+                            f"{view} ran {stats['queries']} queries with {rooms} rooms "
+                            f"(budget {budgets[view]})"
+                        )
+                results['scales'].append(scale)
+    finally:
+        teardown_test_environment()
+
+    return results
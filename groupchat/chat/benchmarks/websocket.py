@@ -0,0 +1,240 @@
+"""Load test for ``ChatConsumer``: connect storm, broadcast latency and throughput.
+
+Simulated clients talk to the real ASGI ``application`` in-process through
+channels' ``WebsocketCommunicator``, so the numbers cover routing, the
+consumer, the channel layer and persistence, but not the network or the
+ASGI server.
+"""
+import asyncio
+import gc
+import json
+import logging
+import time
+import tracemalloc
+from typing import Dict, List
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.test import override_settings
+
+from . import describe_latencies, environment, scratch_database
+
+logger = logging.getLogger(__name__)
+
+# Constants
+CHANNEL_CAPACITY = 10000
+CONNECT_TIMEOUT = 30
+DRAIN_TIMEOUT = 30
+
+
+def add_arguments(parser):
+    parser.add_argument('--clients', type=int, default=100, help="Simulated WebSocket clients")
+    parser.add_argument('--rooms', type=int, default=10, help="Rooms the clients are spread across")
+    parser.add_argument('--messages', type=int, default=10, help="Messages sent by each client")
+    parser.add_argument('--interval', type=float, default=0.0,
+                        help="Seconds each client waits between messages; keep sustained rates "
+                             "under CHAT_RATE_LIMIT_CONNECTION to avoid measuring the limiter")
+    parser.add_argument('--layer', choices=['memory', 'redis'], default='memory', help="Channel layer backend")
+    parser.add_argument('--redis-url', default='redis://127.0.0.1:6379/0',
+                        help="Redis used when --layer=redis")
+
+
+def channel_layer_settings(layer: str, redis_url: str) -> Dict:
+    if layer == 'redis':
+        return {'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [redis_url], 'capacity': CHANNEL_CAPACITY},
+        }}
+    return {'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        'CONFIG': {'capacity': CHANNEL_CAPACITY},
+    }}
+
+
+class SimulatedClient:
+    """One WebSocket connection plus a reader task that timestamps deliveries."""
+
+    def __init__(self, application, index: int, room_code: str, run: 'WebSocketBenchmark'):
+        self.index = index
+        self.room_code = room_code
+        self.username = f'bench{index}'
+        self.run = run
+        self.communicator = WebsocketCommunicator(
+            application, f'/ws/chat/{room_code}/?username={self.username}'
+        )
+        self.reader = None
+        self.rejected = 0
+
+    async def connect(self) -> None:
+        connected, _ = await self.communicator.connect(timeout=CONNECT_TIMEOUT)
+        if not connected:
+            raise RuntimeError(f"{self.username} could not connect to room {self.room_code}")
+        self.reader = asyncio.create_task(self._read())
+
+    async def _read(self) -> None:
+        # Read the output queue directly: receive_output() cancels the
+        # application on timeout, which would end the connection
+        queue = self.communicator.output_queue
+        while True:
+            frame = await queue.get()
+            if frame['type'] != 'websocket.send':
+                return
+            data = json.loads(frame['text'])
+            if 'type' not in data:
+                self.run.delivered(data.get('message'))
+            elif data['type'] == 'batch':
+                for message in data['messages']:
+                    self.run.delivered(message.get('message'))
+            elif data['type'] == 'error' and data.get('code') == 'rate_limited':
+                self.rejected += 1
+                self.run.rejected()
+
+    async def send(self, text: str) -> None:
+        await self.communicator.send_to(text_data=json.dumps({'message': text, 'username': self.username}))
+
+    async def close(self) -> None:
+        if self.reader:
+            self.reader.cancel()
+        await self.communicator.disconnect(timeout=CONNECT_TIMEOUT)
+
+
+class WebSocketBenchmark:
+    def __init__(self, clients: int, rooms: int, messages: int, interval: float = 0.0):
+        self.client_count = clients
+        self.room_count = max(1, min(rooms, clients))
+        self.messages = messages
+        self.interval = interval
+        self.room_codes = [f'BENCH{index:04d}' for index in range(self.room_count)]
+        self.room_sizes: Dict[str, int] = {}
+        self.clients: List[SimulatedClient] = []
+        self.sent_at: Dict[str, float] = {}
+        self.remaining: Dict[str, int] = {}
+        self.latencies: List[float] = []
+        self.rate_limited = 0
+        self.all_delivered = asyncio.Event()
+
+    def delivered(self, text) -> None:
+        sent_at = self.sent_at.get(text)
+        if sent_at is None:
+            return
+        self.latencies.append((time.perf_counter() - sent_at) * 1000)
+        self.remaining[text] -= 1
+        if self.remaining[text] == 0:
+            del self.remaining[text]
+        self._check_done()
+
+    def rejected(self) -> None:
+        self.rate_limited += 1
+        self._check_done()
+
+    def _check_done(self) -> None:
+        # Rejected messages stay in ``remaining`` with nothing left to arrive
+        if len(self.sent_at) == self.expected_messages and len(self.remaining) <= self.rate_limited:
+            self.all_delivered.set()
+
+    @property
+    def expected_messages(self) -> int:
+        return self.client_count * self.messages
+
+    @sync_to_async
+    def create_rooms(self) -> None:
+        from chat.models import Room
+        Room.objects.bulk_create([Room(code=code, name=code) for code in self.room_codes], ignore_conflicts=True)
+
+    async def connect_storm(self, application) -> Dict:
+        from chat.presence import presence_batcher
+
+        self.clients = [
+            SimulatedClient(application, index, self.room_codes[index % self.room_count], self)
+            for index in range(self.client_count)
+        ]
+        for client in self.clients:
+            self.room_sizes[client.room_code] = self.room_sizes.get(client.room_code, 0) + 1
+
+        gc.collect()
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        await asyncio.gather(*(client.connect() for client in self.clients))
+        elapsed = time.perf_counter() - started
+        # Let join announcements and history frames settle before measuring
+        await presence_batcher.flush()
+        await asyncio.sleep(0.1)
+        gc.collect()
+        in_use = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+
+        return {
+            'clients': self.client_count,
+            'elapsed_s': round(elapsed, 4),
+            'connects_per_sec': round(self.client_count / elapsed, 1) if elapsed else None,
+            'memory_per_connection_bytes': in_use // self.client_count,
+        }
+
+    async def _send_from(self, client: SimulatedClient) -> None:
+        for seq in range(self.messages):
+            text = f'{client.username}:{seq}'
+            self.remaining[text] = self.room_sizes[client.room_code]
+            self.sent_at[text] = time.perf_counter()
+            await client.send(text)
+            await asyncio.sleep(self.interval)
+
+    async def broadcast(self) -> Dict:
+        started = time.perf_counter()
+        await asyncio.gather(*(self._send_from(client) for client in self.clients))
+        sent_elapsed = time.perf_counter() - started
+        try:
+            await asyncio.wait_for(self.all_delivered.wait(), timeout=DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"{len(self.remaining)} messages were not fully delivered within {DRAIN_TIMEOUT}s")
+        elapsed = time.perf_counter() - started
+
+        expected_deliveries = sum(
+            self.room_sizes[client.room_code] * (self.messages - client.rejected) for client in self.clients
+        )
+        return {
+            'messages_sent': len(self.sent_at),
+            'messages_rate_limited': self.rate_limited,
+            'deliveries': len(self.latencies),
+            'deliveries_lost': expected_deliveries - len(self.latencies),
+            'elapsed_s': round(elapsed, 4),
+            'messages_per_sec': round(len(self.sent_at) / sent_elapsed, 1) if sent_elapsed else None,
+            'deliveries_per_sec': round(len(self.latencies) / elapsed, 1) if elapsed else None,
+            'latency_ms': describe_latencies(self.latencies),
+        }
+
+    async def run(self) -> Dict:
+        from chat.persistence import message_writer
+        from groupchat.asgi import application
+
+        await self.create_rooms()
+        connect = await self.connect_storm(application)
+        try:
+            broadcast = await self.broadcast()
+        finally:
+            await asyncio.gather(*(client.close() for client in self.clients), return_exceptions=True)
+            await message_writer.flush()
+
+        return {'connect': connect, 'broadcast': broadcast, 'writer': message_writer.stats()}
+
+
+def run(options: Dict) -> Dict:
+    config = {
+        'clients': options['clients'],
+        'rooms': options['rooms'],
+        'messages': options['messages'],
+        'interval': options['interval'],
+        'layer': options['layer'],
+    }
+    with override_settings(CHANNEL_LAYERS=channel_layer_settings(options['layer'], options['redis_url'])):
+        if options['layer'] == 'redis':
+            # Fail fast instead of timing every connect out
+            asyncio.run(get_channel_layer().new_channel())
+        with scratch_database(options.get('verbosity', 0)):
+            benchmark = WebSocketBenchmark(
+                options['clients'], options['rooms'], options['messages'], options['interval']
+            )
+            results = asyncio.run(benchmark.run())
+
+    return {'suite': 'websocket', 'config': config, 'environment': environment(), **results}
@@ -2,10 +2,22 @@ import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from .models import Message, Room
 from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
 from datetime import datetime, timezone
 from urllib.parse import parse_qs
+from .persistence import MessageIdAllocator, message_ids, message_writer
+from .history import (
+    CATCHUP_MAX_MESSAGES, CATCHUP_OVERLAP_MS, CATCHUP_PAGE_SIZE, HISTORY_PAGE_SIZE, MessageHistory,
+)
+from .recent import RECENT_MESSAGES_PER_ROOM, recent_messages
+from .presence import OnlineUserTracker, presence_batcher
+from .protocol import JsonCodec, negotiate
+from .metrics import CATCHUPS, DB_SECONDS, ConsumerMetricsMixin, timed
+from .outbound import OutboundQueue
+from .dedup import MessageDeduplicator, valid_client_id
+from .ratelimit import CONNECTION_MESSAGE_LIMIT, RateLimiter, TokenBucket, scope_ip
 
-class ChatConsumer(AsyncWebsocketConsumer):
+class ChatConsumer(ConsumerMetricsMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.room_code = self.scope['url_route']['kwargs']['room_code']
         self.room_group_name = f'chat_{self.room_code}'
@@ -14,9 +26,17 @@ class ChatConsumer(AsyncWebsocketConsumer):
         query_string = self.scope['query_string'].decode()
         query_params = parse_qs(query_string)
         self.username = query_params.get('username', ['Anonymous'])[0]
+        # Reconnecting clients say which message they saw last
+        try:
+            self.last_seen_id = int(query_params['last_id'][0])
+        except (KeyError, ValueError):
+            self.last_seen_id = None
+        self.client_ip = scope_ip(self.scope)
+        self.rate_limit = TokenBucket(CONNECTION_MESSAGE_LIMIT)
 
         # Check if room exists
-        if not await self.room_exists():
+        self.room_id = await self.get_room_id()
+        if self.room_id is None:
             await self.close()
             return
 
@@ -25,37 +45,44 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             self.channel_name
         )
-        await self.accept()
+        # JSON unless the client offered the binary subprotocol
+        self.codec = negotiate(self.scope.get('subprotocols'))
+        await self.accept(subprotocol=self.codec.subprotocol)
 
-        # Notify others that a user joined
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'chat_notification',
-                'message': f"{self.username} joined the chat.",
-                'username': 'System',
-            }
-        )
+        # Everything sent to this client goes through a bounded queue so a
+        # slow reader cannot stall the room's channel
+        self.outbound = OutboundQueue(self.send_frame, self.close, codec=self.codec)
+        self.outbound.start()
+
+        # Notify others only when this is the user's first open connection;
+        # joins are batched per room so reconnect storms stay cheap
+        if await self.presence_connect():
+            presence_batcher.joined(self.channel_layer, self.room_group_name, self.username)
+
+        # Give the connecting user the full online list once; deltas follow
+        online_users = await self.get_online_users()
+        self.outbound.push({'type': 'presence', 'online': online_users})
 
-        # Send last 20 messages to the connecting user
-        messages = await self.get_last_messages()
-        for msg in messages:
-            await self.send(text_data=json.dumps({
-                'username': msg.username,
-                'message': msg.content,
-                'timestamp': msg.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-            }))
+        # A reconnecting client only needs what it missed; anyone else gets
+        # the last 20 messages as a single frame
+        if self.last_seen_id is None:
+            self.outbound.push(await self.get_history_frame())
+        else:
+            await self.send_catchup(self.last_seen_id)
 
     async def disconnect(self, close_code):
-        # Notify others that user left
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'chat_notification',
-                'message': f"{self.username} left the chat.",
-                'username': 'System',
-            }
-        )
+        if getattr(self, 'room_id', None) is None:
+            return
+
+        if getattr(self, 'outbound', None) is not None:
+            await self.outbound.stop()
+
+        # Make sure everything this connection sent is persisted
+        await message_writer.flush()
+
+        # Notify others once the user's last connection is gone
+        if await self.presence_disconnect():
+            presence_batcher.left(self.channel_layer, self.room_group_name, self.username)
 
         # Leave room group
         await self.channel_layer.group_discard(
@@ -63,50 +90,215 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        # Cheapest check first: this connection's own bucket, in memory
+        wait = self.rate_limit.take()
+        if wait:
+            self.reject_rate_limited(wait)
+            return
+
+        data = self.codec.decode(text_data, bytes_data)
+
+        # Older history requested while scrolling back
+        if data.get('type') == 'history':
+            await self.send_history(data.get('before'), data.get('limit'))
+            return
+
+        # Keep-alive for presence; replaces the old HTTP activity polling
+        if data.get('type') == 'heartbeat':
+            await self.presence_heartbeat()
+            return
+
         message = data['message']
         username = data['username']
+        client_id = data.get('client_id')
+        if client_id is not None and not valid_client_id(client_id):
+            self.outbound.push({'type': 'error', 'code': 'invalid_client_id'})
+            return
+
+        # Shared per-user and per-IP buckets, so extra tabs do not help
+        wait = await self.check_message_rate()
+        if wait:
+            self.reject_rate_limited(wait, client_id)
+            return
 
-        # Save message to DB
-        await self.save_message(self.room_code, username, message)
+        # A retry of a message already sent is acknowledged again, not stored twice
+        message_id = message_ids.next_id()
+        if client_id is not None:
+            existing = await self.claim_client_id(username, client_id, message_id)
+            if existing is not None:
+                self.outbound.push({'type': 'ack', 'client_id': client_id, 'id': existing, 'duplicate': True})
+                return
 
-        # Broadcast message to group
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'chat_message',
-                'message': message,
-                'username': username,
-                'timestamp': datetime.now(timezone.utc).isoformat()
-            }
-        )
+        # Queue message for persistence; the broadcast does not wait for the DB
+        saved = await self.save_message(username, message, message_id)
+
+        payload = {
+            'id': saved.id,
+            'message': message,
+            'username': username,
+            'timestamp': saved.timestamp.isoformat()
+        }
+        recent_messages.append(self.room_code, payload)
+
+        if client_id is not None:
+            self.outbound.push({'type': 'ack', 'client_id': client_id, 'id': saved.id, 'duplicate': False})
+
+        # Broadcast message to group, encoded once for every JSON client
+        await self.broadcast({'type': 'chat_message', **payload, 'frame': json.dumps(payload)})
+
+    async def send_history(self, before, limit):
+        try:
+            before = int(before) if before is not None else None
+            limit = int(limit) if limit else None
+        except (TypeError, ValueError):
+            # Answer anyway, or the client waits for this page forever
+            self.outbound.push({'type': 'error', 'code': 'invalid_history_request'})
+            return
+        page = await self.get_history_page(before, limit)
+        self.outbound.push({'type': 'history', **page})
+
+    async def send_catchup(self, last_seen_id):
+        """Queue the messages after ``last_seen_id`` for a reconnecting client.
+
+        Frames are queued before any live message reaches this consumer, so
+        the client sees the gap and then the live stream. Catch-up starts a
+        little before the client's id, because ids from different workers are
+        not strictly ordered; the client drops repeats. A gap larger than
+        ``CATCHUP_MAX_MESSAGES`` is not replayed: the client gets the latest
+        history page marked ``reset`` and starts over.
+        """
+        after = MessageIdAllocator.rewind(last_seen_id, CATCHUP_OVERLAP_MS)
+        messages, covered = recent_messages.since(self.room_code, after)
+        if not covered:
+            # Unflushed messages are only in the buffer, so merge both
+            stored = await self.get_messages_after(after, CATCHUP_MAX_MESSAGES + 1)
+            merged = {message['id']: message for message in stored}
+            merged.update((message['id'], message) for message in messages)
+            messages = [merged[message_id] for message_id in sorted(merged)]
+
+        if len(messages) > CATCHUP_MAX_MESSAGES:
+            # Too far behind: replace the client's view with the latest page
+            CATCHUPS.labels('reset').inc()
+            page = await recent_messages.get_or_load_page(
+                self.room_code, self.load_recent_messages, limit=HISTORY_PAGE_SIZE
+            )
+            self.outbound.push({'type': 'history', **page, 'reset': True})
+            return
+
+        CATCHUPS.labels('cache' if covered else 'database').inc()
+        # An empty gap still gets one frame, so the client knows it is current
+        pages = [messages[start:start + CATCHUP_PAGE_SIZE]
+                 for start in range(0, len(messages), CATCHUP_PAGE_SIZE)] or [[]]
+        for index, page in enumerate(pages):
+            self.outbound.push({'type': 'catchup', 'messages': page, 'has_more': index < len(pages) - 1})
 
     async def chat_message(self, event):
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({
+        payload = {
+            'id': event.get('id'),
             'message': event['message'],
             'username': event['username'],
             'timestamp': event['timestamp']
-        }))
+        }
+        # Messages sent through other workers only reach this process here
+        if payload['id'] is not None:
+            recent_messages.append(self.room_code, payload)
 
-    async def chat_notification(self, event):
-        # Send system notification to WebSocket
-        await self.send(text_data=json.dumps({
-            'message': event['message'],
-            'username': event['username'],
+        # Queue message for the WebSocket; JSON clients get the broadcast's
+        # frame as-is, shared with every other consumer in this process
+        self.outbound.push_message(payload, encoded=event.get('frame'))
+
+    async def presence_event(self, event):
+        # Send presence delta to WebSocket
+        self.outbound.push({
+            'type': 'presence',
+            'joined': event['joined'],
+            'left': event['left'],
             'timestamp': datetime.now(timezone.utc).isoformat()
-        }))
+        })
+
+    async def summary_result(self, event):
+        # Deliver a finished background summary to WebSocket
+        self.outbound.push({'type': 'summary', **event['job']})
+
+    def reject_rate_limited(self, wait, client_id=None):
+        frame = {
+            'type': 'error',
+            'code': 'rate_limited',
+            'retry_after': RateLimiter.retry_after(wait)
+        }
+        if client_id is not None:
+            frame['client_id'] = client_id
+        self.outbound.push(frame)
+
+    async def send_frame(self, data):
+        if isinstance(data, bytes):
+            await self.send(bytes_data=data)
+        else:
+            await self.send(text_data=data)
+
+    async def save_message(self, username, message, message_id=None):
+        msg = Message(
+            id=message_id or message_ids.next_id(),
+            room_id=self.room_id,
+            username=username,
+            content=message,
+            timestamp=datetime.now(timezone.utc),
+        )
+        await message_writer.enqueue(msg)
+        return msg
+
+    async def get_history_frame(self):
+        # JSON clients share the room's cached, pre-encoded frame
+        if isinstance(self.codec, JsonCodec):
+            return await recent_messages.get_or_load_frame(
+                self.room_code, self.load_recent_messages, limit=HISTORY_PAGE_SIZE
+            )
+        page = await recent_messages.get_or_load_page(
+            self.room_code, self.load_recent_messages, limit=HISTORY_PAGE_SIZE
+        )
+        return {'type': 'history', **page}
+
+    @database_sync_to_async
+    @timed(DB_SECONDS, operation='load_recent_messages')
+    def load_recent_messages(self):
+        return MessageHistory.get_page(self.room_id, limit=RECENT_MESSAGES_PER_ROOM)['messages']
+
+    @database_sync_to_async
+    @timed(DB_SECONDS, operation='get_history_page')
+    def get_history_page(self, before, limit):
+        return MessageHistory.get_page(self.room_id, before=before, limit=limit)
+
+    @database_sync_to_async
+    @timed(DB_SECONDS, operation='get_messages_after')
+    def get_messages_after(self, after, limit):
+        return MessageHistory.get_after(self.room_id, after, limit)
+
+    @sync_to_async(thread_sensitive=False)
+    def presence_connect(self):
+        return OnlineUserTracker.user_connected(self.room_code, self.username, self.channel_name)
+
+    @sync_to_async(thread_sensitive=False)
+    def presence_disconnect(self):
+        return OnlineUserTracker.user_disconnected(self.room_code, self.username, self.channel_name)
+
+    @sync_to_async(thread_sensitive=False)
+    def presence_heartbeat(self):
+        return OnlineUserTracker.mark_user_online(self.room_code, self.username, self.channel_name)
+
+    @sync_to_async(thread_sensitive=False)
+    def check_message_rate(self):
+        return RateLimiter.check_message(self.username, self.client_ip)
 
-    @sync_to_async
-    def save_message(self, room_code, username, message):
-        room = Room.objects.get(code=room_code)
-        return Message.objects.create(room=room, username=username, content=message)
+    @sync_to_async(thread_sensitive=False)
+    def claim_client_id(self, username, client_id, message_id):
+        return MessageDeduplicator.claim(self.room_code, username, client_id, message_id)
 
-    @sync_to_async
-    def get_last_messages(self):
-        return Message.objects.filter(room__code=self.room_code).order_by('-timestamp')[:20][::-1]
+    @sync_to_async(thread_sensitive=False)
+    def get_online_users(self):
+        return OnlineUserTracker.get_online_users(self.room_code)
 
-    @sync_to_async
-    def room_exists(self):
-        return Room.objects.filter(code=self.room_code).exists()
\ No newline at end of file
+    @database_sync_to_async
+    @timed(DB_SECONDS, operation='get_room_id')
+    def get_room_id(self):
+        return Room.objects.filter(code=self.room_code).values_list('id', flat=True).first()
\ No newline at end of file
@@ -0,0 +1,137 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from django.conf import settings
+
+from .metrics import Counter
+from .presence import REDIS_AVAILABLE
+
+if REDIS_AVAILABLE:
+    import redis
+
+logger = logging.getLogger(__name__)
+
+# Constants
+DEDUP_WINDOW_SIZE = getattr(settings, 'CHAT_DEDUP_WINDOW_SIZE', 1000)  # client ids remembered per room
+DEDUP_TTL = getattr(settings, 'CHAT_DEDUP_TTL', 300)  # seconds a client id is remembered
+DEDUP_MAX_ROOMS = 1000
+DEDUP_KEY_PREFIX = 'dedup'
+MAX_CLIENT_ID_LENGTH = 64
+
+DUPLICATE_MESSAGES = Counter('chat_duplicate_messages_total', 'Retried messages answered from the dedup window.')
+
+# Returns the id already recorded for the key, or records ours and returns nil
+CLAIM_SCRIPT = """
+local existing = redis.call('GET', KEYS[1])
+if existing then
+    return existing
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return false
+"""
+
+
+def valid_client_id(client_id) -> bool:
+    return isinstance(client_id, str) and 0 < len(client_id) <= MAX_CLIENT_ID_LENGTH
+
+
+class LocalDedupWindow:
+    """Per-room windows of recent client message ids, in-process only.
+
+    Each room keeps its newest ``per_room`` ids for at most ``ttl`` seconds
+    in insertion order, so expiry and overflow both trim from the front.
+    Rooms are evicted least recently used beyond ``max_rooms``.
+    """
+
+    def __init__(self, per_room: int = DEDUP_WINDOW_SIZE, ttl: float = DEDUP_TTL,
+                 max_rooms: int = DEDUP_MAX_ROOMS):
+        self.per_room = per_room
+        self.ttl = ttl
+        self.max_rooms = max_rooms
+        self._rooms: "OrderedDict[str, OrderedDict[str, Tuple[int, float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, room_code: str, key: str, message_id: int) -> Optional[int]:
+        now = time.monotonic()
+        with self._lock:
+            window = self._rooms.get(room_code)
+            if window is None:
+                window = self._rooms[room_code] = OrderedDict()
+                while len(self._rooms) > self.max_rooms:
+                    self._rooms.popitem(last=False)
+            else:
+                self._rooms.move_to_end(room_code)
+
+            while window and next(iter(window.values()))[1] <= now:
+                window.popitem(last=False)
+
+            existing = window.get(key)
+            if existing is not None:
+                return existing[0]
+            window[key] = (message_id, now + self.ttl)
+            if len(window) > self.per_room:
+                window.popitem(last=False)
+            return None
+
+
+class RedisDedupWindow:
+    """Client ids shared by every worker, so a retry on another connection is still caught.
+
+    Keys expire after ``ttl`` seconds, which is what bounds each room's
+    window here. Falls back to the in-process window while Redis is unreachable.
+    """
+
+    def __init__(self, client, ttl: float = DEDUP_TTL):
+        self.client = client
+        self.ttl = ttl
+        self.script = client.register_script(CLAIM_SCRIPT)
+        self.fallback = LocalDedupWindow(ttl=ttl)
+
+    def claim(self, room_code: str, key: str, message_id: int) -> Optional[int]:
+        try:
+            existing = self.script(keys=[f'{DEDUP_KEY_PREFIX}:{room_code}:{key}'],
+                                   args=[message_id, max(1, int(self.ttl))])
+        except redis.RedisError as e:
+            logger.warning(f"Deduplicating locally, Redis unavailable: {e}")
+            return self.fallback.claim(room_code, key, message_id)
+        return int(existing) if existing is not None else None
+
+
+_window = None
+
+
+def get_dedup_window():
+    """Return the process-wide dedup window, Redis-backed when configured."""
+    global _window
+    if _window is None:
+        redis_url = getattr(settings, 'DEDUP_REDIS_URL', None)
+        if redis_url and REDIS_AVAILABLE:
+            _window = RedisDedupWindow(redis.Redis.from_url(redis_url, decode_responses=True))
+        else:
+            _window = LocalDedupWindow()
+    return _window
+
+
+def set_dedup_client(client) -> None:
+    """Swap the Redis client, e.g. for a fakeredis instance in tests."""
+    global _window
+    _window = RedisDedupWindow(client) if client is not None else LocalDedupWindow()
+
+
+class MessageDeduplicator:
+    # Makes client retries idempotent before anything is persisted or broadcast.
+    @staticmethod
+    def claim(room_code: str, username: str, client_id: str, message_id: int) -> Optional[int]:
+        """Record ``client_id`` for ``message_id``; returns the earlier id if it was already sent."""
+        try:
+            existing = get_dedup_window().claim(room_code, f'{username}:{client_id}', message_id)
+        except Exception as e:
+            # Better a rare duplicate than a lost message
+            logger.error(f"Error checking message {client_id} for duplicates: {e}")
+            return None
+        if existing is not None:
+            DUPLICATE_MESSAGES.inc()
+        return existing
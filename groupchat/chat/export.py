@@ -0,0 +1,125 @@
+import csv
+import io
+import json
+import zlib
+from itertools import chain
+from typing import AsyncIterator, Iterator, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .archive import MessageArchive
+from .models import Message
+
+# Constants
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+EXPORT_CHUNK_SIZE = getattr(settings, 'CHAT_EXPORT_CHUNK_SIZE', 2000)  # rows per fetch and per yielded chunk
+EXPORT_FIELDS = ('id', 'username', 'message', 'timestamp')
+GZIP_LEVEL = 6
+
+
+class TranscriptExport:
+    """Streams a room's messages as NDJSON or CSV, optionally gzipped.
+
+    Rows come from the room's archive segments and then a chunked cursor
+    over the hot table, in id order. Each chunk is encoded (and
+    compressed) before the next one is fetched, so memory stays flat
+    however large the room is. ``since`` skips every message
+    up to and including that id, and ``last_id`` is the id of the last
+    row written, which is where the next incremental export starts.
+    """
+
+    def __init__(self, room_id: int, fmt: str = 'ndjson', since: Optional[int] = None,
+                 compress: bool = False, chunk_size: int = EXPORT_CHUNK_SIZE):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format {fmt!r}; expected one of {tuple(EXPORT_FORMATS)}")
+        self.room_id = room_id
+        self.format = fmt
+        self.since = since
+        self.compress = compress
+        self.chunk_size = max(1, chunk_size)
+        self.count = 0
+        self.last_id = since
+
+    @property
+    def content_type(self) -> str:
+        return 'application/gzip' if self.compress else EXPORT_FORMATS[self.format]
+
+    def filename(self, room_code: str) -> str:
+        name = f'{room_code}.{self.format}'
+        if self.since:
+            name = f'{room_code}-since-{self.since}.{self.format}'
+        return f'{name}.gz' if self.compress else name
+
+    def rows(self) -> Iterator[tuple]:
+        queryset = Message.objects.filter(room_id=self.room_id)
+        if self.since is not None:
+            queryset = queryset.filter(id__gt=self.since)
+        # Server-side cursor where the database has one, fetchmany() otherwise
+        hot = queryset.order_by('id').values_list('id', 'username', 'content', 'timestamp').iterator(
+            chunk_size=self.chunk_size
+        )
+        if not MessageArchive.has_archive(self.room_id):
+            return hot
+        # Archived messages are older than every hot one
+        return chain(MessageArchive.iter_rows(self.room_id, self.since), hot)
+
+    def _encoded(self) -> Iterator[bytes]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if self.format == 'csv' else None
+        if writer:
+            writer.writerow(EXPORT_FIELDS)
+
+        pending = 0
+        for message_id, username, content, timestamp in self.rows():
+            if writer:
+                writer.writerow((message_id, username, content, timestamp.isoformat()))
+            else:
+                buffer.write(json.dumps({
+                    'id': message_id, 'username': username, 'message': content, 'timestamp': timestamp.isoformat(),
+                }))
+                buffer.write('\n')
+            self.count += 1
+            self.last_id = message_id
+            pending += 1
+            if pending >= self.chunk_size:
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+                pending = 0
+
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+
+    def chunks(self) -> Iterator[bytes]:
+        if not self.compress:
+            yield from self._encoded()
+            return
+
+        # wbits=31 writes a gzip header and trailer, so the output is a .gz file
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        for chunk in self._encoded():
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+
+    async def achunks(self) -> AsyncIterator[bytes]:
+        """``chunks()`` for ASGI, which would otherwise read a sync iterator to the end first.
+
+        Every step runs in the same thread, so the cursor stays on the
+        connection that opened it, and is closed there if the client goes away.
+        """
+        iterator = self.chunks()
+        next_chunk = sync_to_async(next, thread_sensitive=True)
+        try:
+            while True:
+                chunk = await next_chunk(iterator, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            await sync_to_async(iterator.close, thread_sensitive=True)()
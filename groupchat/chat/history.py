@@ -0,0 +1,100 @@
+import json
+import logging
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db.models import Q
+
+from .archive import MessageArchive
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+# Constants
+HISTORY_PAGE_SIZE = 20
+MAX_HISTORY_PAGE_SIZE = 100
+CATCHUP_PAGE_SIZE = getattr(settings, 'CHAT_CATCHUP_PAGE_SIZE', 100)  # messages per catch-up frame
+CATCHUP_MAX_MESSAGES = getattr(settings, 'CHAT_CATCHUP_MAX_MESSAGES', 1000)  # larger gaps reset instead
+CATCHUP_OVERLAP_MS = 2000  # resume this far before the client's last id; clients dedupe
+
+
+def serialize_message(row: Dict) -> Dict:
+    """Convert a ``Message.values()`` row into the wire format used by the consumer."""
+    return {
+        'id': row['id'],
+        'username': row['username'],
+        'message': row['content'],
+        'timestamp': row['timestamp'].isoformat(),
+    }
+
+
+def encode_history_frame(page: Dict) -> str:
+    """Encode a history page as a single WebSocket text frame."""
+    return json.dumps({'type': 'history', **page})
+
+
+class MessageHistory:
+    """Keyset pagination over a room's messages ordered by (timestamp, id)."""
+
+    @staticmethod
+    def clamp_limit(limit: Optional[int]) -> int:
+        if not limit:
+            return HISTORY_PAGE_SIZE
+        return max(1, min(int(limit), MAX_HISTORY_PAGE_SIZE))
+
+    @staticmethod
+    def get_page(room_id: int, before: Optional[int] = None,
+                 limit: Optional[int] = None) -> Dict:
+        """Return up to ``limit`` messages older than message ``before``, oldest first.
+
+        Every page is an index range scan on (room_id, timestamp, id), so the
+        cost does not depend on how far back the client has scrolled. Once
+        the hot table runs out, the page continues into the room's archive.
+        """
+        limit = MessageHistory.clamp_limit(limit)
+        queryset = Message.objects.filter(room_id=room_id)
+
+        if before is not None:
+            before_ts = (
+                Message.objects.filter(room_id=room_id, id=before)
+                .values_list('timestamp', flat=True)
+                .first()
+            )
+            if before_ts is None:
+                # Cursor row is not hot (not flushed yet, or archived); ids are time ordered
+                queryset = queryset.filter(id__lt=before)
+            else:
+                # The leading range on timestamp keeps this an index seek; the
+                # OR only disambiguates rows sharing the cursor's timestamp.
+                queryset = queryset.filter(
+                    Q(timestamp__lte=before_ts)
+                    & (Q(timestamp__lt=before_ts) | Q(id__lt=before))
+                )
+
+        rows = list(
+            queryset.order_by('-timestamp', '-id')
+            .values('id', 'username', 'content', 'timestamp')[:limit + 1]
+        )
+        if len(rows) <= limit and MessageArchive.has_archive(room_id):
+            # Everything archived is older than everything still hot
+            cursor = rows[-1]['id'] if rows else before
+            rows += MessageArchive.read_before(room_id, cursor, limit + 1 - len(rows))
+
+        has_more = len(rows) > limit
+        messages: List[Dict] = [serialize_message(row) for row in reversed(rows[:limit])]
+
+        return {
+            'messages': messages,
+            'has_more': has_more,
+            'next_before': messages[0]['id'] if has_more else None,
+        }
+
+    @staticmethod
+    def get_after(room_id: int, after: int, limit: int) -> List[Dict]:
+        """Up to ``limit`` messages with an id above ``after``, oldest first, for reconnect catch-up."""
+        rows = (
+            Message.objects.filter(room_id=room_id, id__gt=after)
+            .order_by('id')
+            .values('id', 'username', 'content', 'timestamp')[:limit]
+        )
+        return [serialize_message(row) for row in rows]
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from chat.archive import ARCHIVE_BATCH_SIZE, DEFAULT_RETENTION_DAYS, DEFAULT_RETENTION_MESSAGES, archive_room
+from chat.models import Room
+
+
+class Command(BaseCommand):
+    help = "Move messages outside each room's retention policy into compressed archive segments."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--room', help="Only archive the room with this code")
+        parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE, help="Messages per segment")
+        parser.add_argument('--dry-run', action='store_true', help="Report what would be archived")
+
+    def handle(self, *args, **options):
+        rooms = Room.objects.order_by('pk')
+        if options['room']:
+            rooms = rooms.filter(code=options['room'].upper())
+        elif DEFAULT_RETENTION_DAYS is None and DEFAULT_RETENTION_MESSAGES is None:
+            # Without defaults only rooms with their own policy have anything to archive
+            rooms = rooms.exclude(retention_days__isnull=True, retention_messages__isnull=True)
+
+        total = 0
+        for room in rooms.iterator():
+            archived = archive_room(room, batch_size=options['batch_size'], dry_run=options['dry_run'])
+            if archived:
+                total += archived
+                self.stdout.write(f"{room.code}: {archived} messages")
+
+        action = "would archive" if options['dry_run'] else "archived"
+        self.stdout.write(self.style.SUCCESS(f"{action.capitalize()} {total} messages"))
@@ -0,0 +1,31 @@
+from importlib import import_module
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.benchmarks import SUITES, dump_results
+
+
+class Command(BaseCommand):
+    help = "Run a benchmark suite and print its results as JSON."
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='suite', required=True)
+        for name, module_path in SUITES.items():
+            suite_parser = subparsers.add_parser(name)
+            suite_parser.add_argument('--output', help="Write the JSON results to this file")
+            import_module(module_path).add_arguments(suite_parser)
+
+    def handle(self, *args, **options):
+        results = import_module(SUITES[options['suite']]).run(options)
+        output = dump_results(results)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f"Wrote {options['suite']} results to {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+        failures = results.get('failures')
+        if failures:
+            raise CommandError("Benchmark budgets exceeded:\n" + "\n".join(failures))
@@ -0,0 +1,43 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, TranscriptExport
+from chat.models import Room
+
+
+class Command(BaseCommand):
+    help = "Stream a room's transcript to a file or stdout, for backups and archives."
+
+    def add_arguments(self, parser):
+        parser.add_argument('room_code')
+        parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='ndjson')
+        parser.add_argument('--since', type=int, help="Only messages after this id, for incremental backups")
+        parser.add_argument('--gzip', action='store_true', help="Compress the output")
+        parser.add_argument('--output', '-o', help="File to write; stdout when omitted")
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        room = Room.objects.filter(code=options['room_code'].upper()).first()
+        if room is None:
+            raise CommandError(f"Room {options['room_code']} does not exist")
+
+        export = TranscriptExport(
+            room.id, options['format'], since=options['since'], compress=options['gzip'],
+            chunk_size=options['chunk_size'],
+        )
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in export.chunks():
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
+
+        # Report on stderr so stdout stays a clean transcript
+        message = f"Exported {export.count} messages from {room.code}"
+        if export.last_id:
+            message += f"; continue with --since {export.last_id}"
+        self.stderr.write(message)
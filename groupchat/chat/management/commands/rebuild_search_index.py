@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.search import BACKFILL_BATCH_SIZE, rebuild_search_index, search_index_ready
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text message search index from the messages table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BACKFILL_BATCH_SIZE,
+                            help="Messages indexed per transaction")
+        parser.add_argument('--optimize', action='store_true',
+                            help="Merge the index into a single segment afterwards")
+
+    def handle(self, *args, **options):
+        if not search_index_ready():
+            raise CommandError(
+                "No full-text index in this database. It is created by migrate on SQLite builds with FTS5; "
+                "other databases use the unindexed fallback."
+            )
+
+        def progress(indexed, last_id, high_water):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"Indexed {indexed} messages (up to id {last_id} of {high_water})")
+
+        indexed = rebuild_search_index(
+            batch_size=options['batch_size'], optimize=options['optimize'], progress=progress
+        )
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} messages"))
@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, DateTimeField, IntegerField, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from chat.models import ArchiveSegment, Message, Room
+
+
+class Command(BaseCommand):
+    help = "Recompute denormalized room counters and fix any that have drifted."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--room', help="Only reconcile the room with this code")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help="Report drift without fixing it")
+
+    @staticmethod
+    def fix(room_pk, actual):
+        """Recount one room while holding its row, so concurrent writers are not overwritten.
+
+        The write-behind queue inserts messages and bumps the counters in
+        one transaction. Locking the row first waits for any such
+        transaction that already bumped it, and the recount then sees its
+        messages; one that starts later adds its increment on top.
+        """
+        with transaction.atomic():
+            list(Room.objects.select_for_update().filter(pk=room_pk).values_list('pk'))
+            Room.objects.filter(pk=room_pk).update(**actual)
+
+    def handle(self, *args, **options):
+        rooms = Room.objects.order_by('pk')
+        if options['room']:
+            rooms = rooms.filter(code=options['room'].upper())
+
+        messages = Message.objects.filter(room=OuterRef('pk')).order_by().values('room')
+        members = Room.users.through.objects.filter(room=OuterRef('pk')).order_by().values('room')
+        # Archived messages still count towards the room's totals
+        segments = ArchiveSegment.objects.filter(room=OuterRef('pk')).order_by().values('room')
+        # The true value of each counter, computed in SQL for the room at hand
+        actual = {
+            'message_count': Coalesce(
+                Subquery(messages.annotate(count=Count('pk')).values('count'), output_field=IntegerField()), 0
+            ) + Coalesce(
+                Subquery(segments.annotate(count=Sum('message_count')).values('count'), output_field=IntegerField()), 0
+            ),
+            'member_count': Coalesce(
+                Subquery(members.annotate(count=Count('pk')).values('count'), output_field=IntegerField()), 0
+            ),
+            'last_message_at': Coalesce(
+                Subquery(messages.annotate(latest=Max('timestamp')).values('latest')),
+                Subquery(segments.annotate(latest=Max('last_timestamp')).values('latest')),
+                output_field=DateTimeField(),
+            ),
+        }
+        rooms = rooms.annotate(**{f'actual_{field}': expression for field, expression in actual.items()})
+
+        checked = drifted = 0
+        last_pk = 0
+        while True:
+            batch = list(rooms.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            for room in batch:
+                checked += 1
+                if (room.message_count, room.member_count, room.last_message_at) == (
+                        room.actual_message_count, room.actual_member_count, room.actual_last_message_at):
+                    continue
+                drifted += 1
+                self.stdout.write(
+                    f"{room.code}: messages {room.message_count} -> {room.actual_message_count}, "
+                    f"members {room.member_count} -> {room.actual_member_count}, "
+                    f"last message {room.last_message_at} -> {room.actual_last_message_at}"
+                )
+                if not options['dry_run']:
+                    self.fix(room.pk, actual)
+
+        action = "found" if options['dry_run'] else "fixed"
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} rooms, {action} {drifted} with drift"))
@@ -0,0 +1,307 @@
+"""In-process metrics with Prometheus text exposition at ``/metrics``.
+
+Counters, gauges and histograms are kept per process (scrape every
+worker). Hot paths are instrumented through ``timed``, the consumer mixin
+and the middleware, so recording a sample is a lock and an addition.
+"""
+import asyncio
+import bisect
+import functools
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], '_Metric'] = {}
+        REGISTRY.register(self)
+
+    def labels(self, *values, **labels) -> '_Metric':
+        if labels:
+            values = tuple(str(labels[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def remove(self, *values) -> None:
+        with self._lock:
+            self._children.pop(tuple(str(value) for value in values), None)
+
+    def _new_child(self) -> '_Metric':
+        child = object.__new__(type(self))
+        child.__dict__.update(self._child_config())
+        child._lock = threading.Lock()
+        child._init_value()
+        return child
+
+    def _child_config(self) -> Dict:
+        return {}
+
+    def _series(self) -> Iterable[Tuple[Tuple[str, ...], '_Metric']]:
+        if not self.labelnames:
+            return [((), self)]
+        return list(self._children.items())
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for values, child in self._series():
+            lines.extend(child._samples(self.name, self.labelnames, values))
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._init_value()
+
+    def _init_value(self) -> None:
+        self._value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def _samples(self, name, labelnames, values) -> List[str]:
+        return [f'{name}{_format_labels(labelnames, values)} {_format_value(self._value)}']
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self._value = value
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+        self._init_value()
+
+    def _child_config(self) -> Dict:
+        return {'buckets': self.buckets}
+
+    def _init_value(self) -> None:
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def _samples(self, name, labelnames, values) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self._counts):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f'{name}_bucket{_format_labels(labelnames, values, le)} {cumulative}')
+        lines.append(f'{name}_sum{_format_labels(labelnames, values)} {_format_value(self._sum)}')
+        lines.append(f'{name}_count{_format_labels(labelnames, values)} {cumulative}')
+        return lines
+
+
+class CallbackMetric:
+    """A metric whose value is read from existing stats at scrape time."""
+
+    def __init__(self, name: str, documentation: str, kind: str, callback: Callable[[], float]):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.callback = callback
+        REGISTRY.register(self)
+
+    def render(self) -> List[str]:
+        return [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}',
+            f'{self.name} {_format_value(self.callback())}',
+        ]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def register(self, metric) -> None:
+        self._metrics[metric.name] = metric
+
+    def get(self, name: str):
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # A broken callback must not take the whole scrape down
+                logger.error(f"Error rendering metric {metric.name}: {e}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def timed(histogram: Histogram, **labels) -> Callable:
+    """Record how long each call takes, for plain and async functions alike."""
+    target = histogram.labels(**labels) if labels else histogram
+
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    target.observe(time.perf_counter() - started)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                target.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+# WebSocket
+ACTIVE_CONNECTIONS = Gauge('chat_active_connections', 'Open WebSocket connections.')
+# Room codes are join secrets, so they never appear in labels; only the count is exported
+_room_connections: Dict[str, int] = {}
+ACTIVE_ROOMS = CallbackMetric(
+    'chat_active_rooms', 'Rooms with at least one open WebSocket connection.', 'gauge',
+    lambda: len(_room_connections),
+)
+MESSAGES_IN = Counter('chat_messages_received_total', 'WebSocket frames received from clients.')
+MESSAGES_OUT = Counter('chat_messages_sent_total', 'WebSocket frames sent to clients.')
+GROUP_SEND_SECONDS = Histogram('chat_group_send_seconds', 'Time spent in channel layer group_send.')
+CATCHUPS = Counter('chat_catchups_total', 'Reconnect catch-ups by where the gap was read from.', ['source'])
+
+# Database and caches
+DB_SECONDS = Histogram('chat_db_seconds', 'Time spent in database calls.', ['operation'])
+PRESENCE_SECONDS = Histogram('chat_presence_seconds', 'Time spent in presence backend calls.', ['operation'])
+
+# HTTP
+HTTP_REQUESTS = Counter('chat_http_requests_total', 'HTTP requests handled.', ['view', 'method', 'status'])
+HTTP_SECONDS = Histogram('chat_http_request_seconds', 'HTTP request latency.', ['view'])
+
+# Summaries
+SUMMARY_SECONDS = Histogram(
+    'chat_summary_seconds', 'Duration of room summarization.', ['outcome'],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+)
+SUMMARY_LLM_SECONDS = Histogram(
+    'chat_summary_llm_seconds', 'Duration of individual summarization model calls.',
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+
+
+class ConsumerMetricsMixin:
+    """Counts connections and frames for a WebSocket consumer.
+
+    Put it before the consumer base class; the consumer itself needs no
+    metrics calls apart from using ``broadcast`` for group sends.
+    """
+
+    _metrics_room: Optional[str] = None
+
+    async def accept(self, *args, **kwargs):
+        await super().accept(*args, **kwargs)
+        self._metrics_room = self.scope['url_route']['kwargs'].get('room_code', '')
+        ACTIVE_CONNECTIONS.inc()
+        _room_connections[self._metrics_room] = _room_connections.get(self._metrics_room, 0) + 1
+
+    async def websocket_receive(self, message):
+        MESSAGES_IN.inc()
+        await super().websocket_receive(message)
+
+    async def send(self, *args, **kwargs):
+        MESSAGES_OUT.inc()
+        await super().send(*args, **kwargs)
+
+    async def websocket_disconnect(self, message):
+        if self._metrics_room is not None:
+            ACTIVE_CONNECTIONS.dec()
+            remaining = _room_connections.get(self._metrics_room, 0) - 1
+            if remaining > 0:
+                _room_connections[self._metrics_room] = remaining
+            else:
+                _room_connections.pop(self._metrics_room, None)
+            self._metrics_room = None
+        await super().websocket_disconnect(message)
+
+    @timed(GROUP_SEND_SECONDS)
+    async def broadcast(self, event: Dict) -> None:
+        await self.channel_layer.group_send(self.room_group_name, event)
+
+
+class MetricsMiddleware:
+    """Times every HTTP request, labelled by URL name."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match and match.url_name else 'unmatched'
+        HTTP_SECONDS.labels(view).observe(time.perf_counter() - started)
+        HTTP_REQUESTS.labels(view, request.method, response.status_code).inc()
+        return response
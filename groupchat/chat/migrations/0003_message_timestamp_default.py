@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:22
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0002_alter_message_options_alter_room_options_and_more"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="message",
+            name="timestamp",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
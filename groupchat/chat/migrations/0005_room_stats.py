@@ -0,0 +1,55 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:28
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_room_stats(apps, schema_editor):
+    Room = apps.get_model('chat', 'Room')
+    Message = apps.get_model('chat', 'Message')
+    Membership = Room.users.through
+
+    messages = Message.objects.filter(room=OuterRef('pk')).order_by().values('room')
+    members = Membership.objects.filter(room=OuterRef('pk')).order_by().values('room')
+    Room.objects.update(
+        message_count=Coalesce(
+            Subquery(messages.annotate(count=Count('pk')).values('count'), output_field=IntegerField()), 0
+        ),
+        member_count=Coalesce(
+            Subquery(members.annotate(count=Count('pk')).values('count'), output_field=IntegerField()), 0
+        ),
+        last_message_at=Subquery(messages.annotate(latest=Max('timestamp')).values('latest')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_message_room_ts_id_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='member_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['is_public', '-last_message_at'], name='chat_room_public_active_idx'),
+        ),
+        migrations.RunPython(backfill_room_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_room_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('summary', models.TextField()),
+                ('last_message_id', models.BigIntegerField(default=0)),
+                ('message_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('room', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='chat.room')),
+            ],
+        ),
+    ]
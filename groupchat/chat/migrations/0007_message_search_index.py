@@ -0,0 +1,80 @@
+from django.db import migrations
+
+# External-content FTS5 index over chat_message. Rows are read back from
+# chat_message itself, and triggers keep the index in step with every
+# insert, update and delete, including bulk_create from the write-behind
+# queue. room_id is indexed as a token so searches stay within one room.
+CREATE_INDEX = [
+    """
+    CREATE VIRTUAL TABLE chat_message_fts USING fts5(
+        content, room_id,
+        content='chat_message', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER chat_message_fts_insert AFTER INSERT ON chat_message BEGIN
+        INSERT INTO chat_message_fts(rowid, content, room_id) VALUES (new.id, new.content, new.room_id);
+    END
+    """,
+    """
+    CREATE TRIGGER chat_message_fts_delete AFTER DELETE ON chat_message BEGIN
+        INSERT INTO chat_message_fts(chat_message_fts, rowid, content, room_id)
+        VALUES ('delete', old.id, old.content, old.room_id);
+    END
+    """,
+    """
+    CREATE TRIGGER chat_message_fts_update AFTER UPDATE OF content, room_id ON chat_message BEGIN
+        INSERT INTO chat_message_fts(chat_message_fts, rowid, content, room_id)
+        VALUES ('delete', old.id, old.content, old.room_id);
+        INSERT INTO chat_message_fts(rowid, content, room_id) VALUES (new.id, new.content, new.room_id);
+    END
+    """,
+    "INSERT INTO chat_message_fts(chat_message_fts) VALUES ('rebuild')",
+]
+
+DROP_INDEX = [
+    "DROP TRIGGER IF EXISTS chat_message_fts_insert",
+    "DROP TRIGGER IF EXISTS chat_message_fts_delete",
+    "DROP TRIGGER IF EXISTS chat_message_fts_update",
+    "DROP TABLE IF EXISTS chat_message_fts",
+]
+
+
+def fts5_available(connection) -> bool:
+    if connection.vendor != 'sqlite':
+        return False
+    # Not every SQLite build includes FTS5
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE temp.chat_fts5_probe USING fts5(x)")
+        except Exception:
+            return False
+        cursor.execute("DROP TABLE temp.chat_fts5_probe")
+    return True
+
+
+def create_index(apps, schema_editor):
+    # Other databases fall back to a plain scan; see chat.search
+    if not fts5_available(schema_editor.connection):
+        return
+    for statement in CREATE_INDEX:
+        schema_editor.execute(statement)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP_INDEX:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_room_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 class Room(models.Model):
@@ -7,10 +9,32 @@ class Room(models.Model):
     users = models.ManyToManyField(User, related_name='rooms')
     created_at = models.DateTimeField(auto_now_add=True)
     is_public = models.BooleanField(default=True)
+    # Denormalized statistics, maintained incrementally; see reconcile_room_stats
+    message_count = models.PositiveIntegerField(default=0)
+    member_count = models.PositiveIntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    # Retention: older messages move to archive segments; unset means the
+    # CHAT_RETENTION_* defaults, which keep everything hot
+    retention_days = models.PositiveIntegerField(null=True, blank=True)
+    retention_messages = models.PositiveIntegerField(null=True, blank=True)
 
     def __str__(self):
         return self.code
 
+    @classmethod
+    def record_messages(cls, room_id, count, last_message_at):
+        """Fold a batch of newly persisted messages into the room's counters."""
+        cls.objects.filter(pk=room_id).update(
+            message_count=F('message_count') + count,
+            last_message_at=Case(
+                When(
+                    Q(last_message_at__isnull=True) | Q(last_message_at__lt=last_message_at),
+                    then=Value(last_message_at),
+                ),
+                default=F('last_message_at'),
+            ),
+        )
+
     def user_names(self):
         return [user.username for user in self.users.all()]
 
@@ -18,22 +42,60 @@ class Room(models.Model):
         return self.messages.all()
 
     def user_count(self):
-        return self.users.count()
+        return self.member_count
     
     def get_display_name(self):
         return self.name if self.name.strip() else f"Room {self.code}"
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['is_public', '-last_message_at'], name='chat_room_public_active_idx'),
+        ]
 
 class Message(models.Model):
     room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='messages')
     username = models.CharField(max_length=100)
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)
 
     def __str__(self):
         return f"[{self.timestamp}] {self.username}: {self.content}"
     
     class Meta:
-        ordering = ['timestamp']
\ No newline at end of file
+        ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['room', 'timestamp', 'id'], name='chat_msg_room_ts_id_idx'),
+        ]
+
+class ArchiveSegment(models.Model):
+    """Catalog entry for one immutable file of archived messages; see chat.archive."""
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='archive_segments')
+    path = models.CharField(max_length=255)  # relative to CHAT_ARCHIVE_DIR
+    first_id = models.BigIntegerField()
+    last_id = models.BigIntegerField()
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    message_count = models.PositiveIntegerField()
+    size_bytes = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.room.code} messages {self.first_id}-{self.last_id}"
+
+    class Meta:
+        ordering = ['room', 'last_id']
+        indexes = [
+            models.Index(fields=['room', 'last_id'], name='chat_archive_room_last_idx'),
+        ]
+
+class RoomSummary(models.Model):
+    room = models.OneToOneField(Room, on_delete=models.CASCADE, related_name='summary')
+    summary = models.TextField()
+    # High-water mark: every message with a smaller or equal id is covered
+    last_message_id = models.BigIntegerField(default=0)
+    message_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Summary of {self.room.code} up to message {self.last_message_id}"
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional, Union
+
+from django.conf import settings
+
+from .metrics import Counter, Gauge
+from .protocol import Frame, JsonCodec
+
+logger = logging.getLogger(__name__)
+
+# Constants
+OUTBOUND_QUEUE_SIZE = getattr(settings, 'CHAT_OUTBOUND_QUEUE_SIZE', 256)  # frames per connection
+OUTBOUND_OVERFLOW_POLICY = getattr(settings, 'CHAT_OUTBOUND_OVERFLOW_POLICY', 'drop_oldest')
+OVERFLOW_POLICIES = ('drop_oldest', 'coalesce', 'disconnect')
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+OUTBOUND_QUEUED = Gauge('chat_outbound_queued_frames', 'Frames waiting in per-connection outbound queues.')
+OUTBOUND_DROPPED = Counter(
+    'chat_outbound_dropped_total', 'Messages dropped from full outbound queues.', ['policy']
+)
+OUTBOUND_COALESCED = Counter('chat_outbound_coalesced_total', 'Outbound queue overflows resolved by batching.')
+OUTBOUND_DISCONNECTS = Counter(
+    'chat_outbound_disconnects_total', 'Connections closed because their outbound queue overflowed.'
+)
+
+
+class OutboundQueue:
+    """Bounded queue of frames between a consumer's handlers and its socket.
+
+    Handlers push and return immediately, so a client that reads slowly
+    only backs up its own queue instead of the consumer's channel, which
+    the channel layer shares with the whole room. When the queue is full
+    the overflow policy decides what gives:
+
+    - ``drop_oldest``: discard the oldest queued frame.
+    - ``coalesce``: fold the queued chat messages into one ``batch``
+      frame, keeping the newest ``max_size`` of them.
+    - ``disconnect``: discard the queue, send a ``resync`` frame carrying
+      the last delivered message id and close the connection.
+    """
+
+    def __init__(self, send: Callable[[Frame], Awaitable[None]], close: Callable[..., Awaitable[None]],
+                 codec=None, max_size: int = OUTBOUND_QUEUE_SIZE, policy: str = OUTBOUND_OVERFLOW_POLICY):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown outbound overflow policy {policy!r}; expected one of {OVERFLOW_POLICIES}")
+        self._send = send
+        self._close = close
+        self.codec = codec or JsonCodec()
+        self.max_size = max(2, max_size)
+        self.policy = policy
+        # Each entry is (frame, messages). Frames are dicts, or data already
+        # encoded for this codec. Chat messages carry their payloads, so they
+        # can be coalesced, plus the broadcast's JSON frame when it had one.
+        # Encoding happens at send time, in order,
+        # which keeps per-connection codec state consistent when frames
+        # are dropped
+        self._frames = deque()
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.last_id: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        OUTBOUND_QUEUED.dec(len(self._frames))
+        self._frames.clear()
+
+    def push(self, frame: Union[Dict, Frame]) -> None:
+        """Queue a frame, as a dict or already encoded for this codec."""
+        self._append((frame, None))
+
+    def push_message(self, message: Dict, encoded: Optional[str] = None) -> None:
+        """Queue a chat message payload, with its pre-encoded JSON frame if known."""
+        self._append((encoded, [message]))
+
+    def _append(self, entry) -> None:
+        if self._closing:
+            return
+        if len(self._frames) >= self.max_size:
+            self._overflow()
+            if self._closing:
+                return
+        self._frames.append(entry)
+        OUTBOUND_QUEUED.inc()
+        self._ready.set()
+
+    def _overflow(self) -> None:
+        before = len(self._frames)
+        if self.policy == 'drop_oldest':
+            _, messages = self._frames.popleft()
+            OUTBOUND_DROPPED.labels(self.policy).inc(len(messages) if messages else 1)
+        elif self.policy == 'coalesce':
+            self._coalesce()
+        else:
+            dropped = sum(len(messages) if messages else 1 for _, messages in self._frames)
+            OUTBOUND_DROPPED.labels(self.policy).inc(dropped)
+            OUTBOUND_DISCONNECTS.inc()
+            self._frames.clear()
+            self._frames.append(({'type': 'resync', 'reason': 'slow_consumer', 'last_id': self.last_id}, None))
+            self._closing = True
+            self._ready.set()
+            logger.warning(f"Closing slow connection after {dropped} undelivered frames")
+        OUTBOUND_QUEUED.inc(len(self._frames) - before)
+
+    def _coalesce(self) -> None:
+        messages: List[Dict] = []
+        others = deque()
+        for frame, queued in self._frames:
+            if queued is None:
+                others.append((frame, None))
+            else:
+                messages.extend(queued)
+
+        # Leave room for the batch, if any, and for the frame being pushed
+        limit = self.max_size - (2 if messages else 1)
+        dropped = 0
+        while len(others) > limit:
+            others.popleft()
+            dropped += 1
+        if len(messages) > self.max_size:
+            dropped += len(messages) - self.max_size
+            messages = messages[-self.max_size:]
+        if dropped:
+            OUTBOUND_DROPPED.labels(self.policy).inc(dropped)
+        if messages:
+            others.append((None, messages))
+            OUTBOUND_COALESCED.inc()
+        self._frames = others
+
+    def _encode(self, frame, messages: Optional[List[Dict]]) -> Frame:
+        if messages is not None:
+            if len(messages) == 1:
+                return self.codec.encode_message(messages[0], encoded=frame)
+            return self.codec.encode_messages(messages)
+        if isinstance(frame, dict):
+            return self.codec.encode(frame)
+        return frame
+
+    async def _run(self) -> None:
+        while True:
+            if not self._frames:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+
+            frame, messages = self._frames.popleft()
+            OUTBOUND_QUEUED.dec()
+            try:
+                await self._send(self._encode(frame, messages))
+            except Exception as e:
+                logger.error(f"Error sending queued frame: {e}")
+                continue
+            if messages:
+                self.last_id = messages[-1].get('id') or self.last_id
+
+            if self._closing and not self._frames:
+                await self._close(code=SLOW_CONSUMER_CLOSE_CODE)
+                return
@@ -0,0 +1,338 @@
+import asyncio
+import atexit
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from typing import Dict, List, Optional
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, transaction
+
+from .metrics import DB_SECONDS, CallbackMetric, timed
+from .models import Message, Room
+from .presence import REDIS_AVAILABLE
+
+if REDIS_AVAILABLE:
+    import redis
+
+logger = logging.getLogger(__name__)
+
+# Constants
+WRITE_BATCH_SIZE = getattr(settings, 'CHAT_WRITE_BATCH_SIZE', 100)
+WRITE_FLUSH_INTERVAL = getattr(settings, 'CHAT_WRITE_FLUSH_INTERVAL', 0.25)  # seconds
+WRITE_MAX_QUEUE = getattr(settings, 'CHAT_WRITE_MAX_QUEUE', 10000)
+
+# Message ids are allocated in-process so a message can be broadcast (and
+# referenced by clients) before the write-behind queue has persisted it.
+# Layout: 40 bits of milliseconds since ID_EPOCH_MS, 7 bits of worker id and
+# a 6 bit per-millisecond sequence. That keeps ids time ordered, well above any
+# id previously handed out by the database autoincrement, and below 2**53 so
+# browsers can hold them as plain JavaScript numbers.
+ID_EPOCH_MS = 1735689600000  # 2025-01-01T00:00:00Z
+WORKER_ID_BITS = 7
+SEQUENCE_BITS = 6
+WORKER_LEASE_KEY_PREFIX = 'chat:worker'
+WORKER_LEASE_SECONDS = 60
+
+
+class WorkerLease:
+    """Holds a worker id in Redis so no two live processes allocate with the same one.
+
+    The lease is claimed with ``SET NX`` and renewed from a daemon thread.
+    A process that loses it (Redis flushed, or paused longer than the lease)
+    logs an error, because another process may now be using its id.
+    """
+
+    def __init__(self, client, seconds: int = WORKER_LEASE_SECONDS):
+        self.client = client
+        self.seconds = seconds
+        self.token = f'{socket.gethostname()}:{os.getpid()}'
+        self.key: Optional[str] = None
+
+    def claim(self) -> Optional[int]:
+        for worker_id in random.sample(range(1 << WORKER_ID_BITS), 1 << WORKER_ID_BITS):
+            key = f'{WORKER_LEASE_KEY_PREFIX}:{worker_id}'
+            if self.client.set(key, self.token, nx=True, ex=self.seconds):
+                self.key = key
+                threading.Thread(target=self._renew, name='chat-worker-lease', daemon=True).start()
+                return worker_id
+        return None
+
+    def _renew(self) -> None:
+        while True:
+            time.sleep(self.seconds / 3)
+            try:
+                if self.client.get(self.key) != self.token:
+                    logger.error(f"Lost message id lease {self.key}; ids may collide with another worker")
+                    return
+                self.client.expire(self.key, self.seconds)
+            except redis.RedisError as e:
+                logger.warning(f"Could not renew message id lease {self.key}: {e}")
+
+
+def resolve_worker_id() -> int:
+    """The worker id for this process: configured, leased from Redis, or random.
+
+    Two processes with the same worker id allocate the same ids in the same
+    millisecond, and the second insert of each is then dropped after the
+    message was already broadcast. Deployments with several processes must
+    set a unique ``CHAT_WORKER_ID`` per process or configure Redis.
+    """
+    configured = getattr(settings, 'CHAT_WORKER_ID', None)
+    if configured not in (None, ''):
+        try:
+            worker_id = int(configured)
+        except (TypeError, ValueError):
+            worker_id = -1
+        if not 0 <= worker_id < (1 << WORKER_ID_BITS):
+            raise ImproperlyConfigured(
+                f"CHAT_WORKER_ID must be an integer from 0 to {(1 << WORKER_ID_BITS) - 1}, got {configured!r}"
+            )
+        return worker_id
+
+    redis_url = getattr(settings, 'WORKER_ID_REDIS_URL', None)
+    if redis_url and REDIS_AVAILABLE:
+        try:
+            worker_id = WorkerLease(redis.Redis.from_url(redis_url, decode_responses=True)).claim()
+        except redis.RedisError as e:
+            logger.error(f"Could not lease a message id worker id from Redis: {e}")
+        else:
+            if worker_id is not None:
+                logger.info(f"Leased message id worker id {worker_id}")
+                return worker_id
+            logger.error(f"All {1 << WORKER_ID_BITS} message id worker ids are leased")
+
+    worker_id = random.randrange(1 << WORKER_ID_BITS)
+    logger.warning(
+        f"CHAT_WORKER_ID is not set; using random worker id {worker_id}. "
+        "Set a unique CHAT_WORKER_ID per process when running more than one, or ids can collide."
+    )
+    return worker_id
+
+
+class MessageIdAllocator:
+    """Allocates unique, time ordered message ids without a database round trip."""
+
+    def __init__(self, worker_id: Optional[int] = None):
+        # Resolved on first use, so importing this module never touches Redis
+        self.worker_id = worker_id
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def next_id(self) -> int:
+        with self._lock:
+            if self.worker_id is None:
+                self.worker_id = resolve_worker_id()
+            now_ms = int(time.time() * 1000) - ID_EPOCH_MS
+            if now_ms < self._last_ms:
+                # Clock went backwards; keep issuing ids from the last known millisecond
+                now_ms = self._last_ms
+            if now_ms == self._last_ms:
+                self._sequence = (self._sequence + 1) & ((1 << SEQUENCE_BITS) - 1)
+                if self._sequence == 0:
+                    # Sequence exhausted for this millisecond, borrow the next one
+                    now_ms += 1
+            else:
+                self._sequence = 0
+            self._last_ms = now_ms
+            return (
+                (now_ms << (WORKER_ID_BITS + SEQUENCE_BITS))
+                | (self.worker_id << SEQUENCE_BITS)
+                | self._sequence
+            )
+
+    @staticmethod
+    def rewind(message_id: int, ms: int) -> int:
+        """An id at least ``ms`` milliseconds older than ``message_id``, on any worker.
+
+        Ids are only time ordered across workers up to clock skew and
+        delivery delay, so readers resuming from an id start a little earlier.
+        """
+        return max(0, message_id - ((ms + 1) << (WORKER_ID_BITS + SEQUENCE_BITS)))
+
+
+class MessageWriteBehind:
+    """Buffers chat messages on an asyncio queue and persists them in batches.
+
+    Messages are flushed with ``bulk_create`` once ``batch_size`` messages are
+    waiting or ``flush_interval`` seconds after the first one was queued,
+    whichever comes first.
+    """
+
+    def __init__(self, batch_size: int = WRITE_BATCH_SIZE,
+                 flush_interval: float = WRITE_FLUSH_INTERVAL,
+                 max_queue: int = WRITE_MAX_QUEUE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._batch_ready: Optional[asyncio.Event] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pending: List[Message] = []
+        self._writing: List[Message] = []
+        self._stats = {
+            'enqueued': 0,
+            'written': 0,
+            'failed': 0,
+            'batches': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0,
+        }
+
+    def _ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._task is not None and not self._task.done():
+            return
+
+        # Carry over anything left behind by a previous event loop
+        leftovers = self._drain_nowait() if self._queue is not None else []
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._batch_ready = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._pending = leftovers + self._pending
+        self._task = loop.create_task(self._run())
+
+    async def enqueue(self, message: Message) -> None:
+        """Queue a message for persistence; waits only if the queue is full."""
+        self._ensure_started()
+        await self._queue.put(message)
+        self._stats['enqueued'] += 1
+        if self._queue.qsize() + len(self._pending) >= self.batch_size:
+            self._batch_ready.set()
+
+    async def flush(self) -> None:
+        """Persist everything queued so far before returning."""
+        if self._queue is None:
+            return
+        self._ensure_started()
+        self._pending.extend(self._drain_nowait())
+        await self._flush_pending()
+
+    def queue_depth(self) -> int:
+        queued = self._queue.qsize() if self._queue is not None else 0
+        return queued + len(self._pending)
+
+    def oldest_pending_id(self) -> Optional[int]:
+        """Lowest id queued or being written in this process, or None.
+
+        Safe to call from other threads. Messages move from the queue to
+        ``_pending`` to ``_writing``, and are read in that order, so one in
+        transit is seen in at least one place.
+        """
+        queued = list(self._queue._queue) if self._queue is not None else []
+        waiting = queued + list(self._pending) + list(self._writing)
+        return min((message.id for message in waiting), default=None)
+
+    def stats(self) -> Dict:
+        stats = dict(self._stats)
+        stats['queue_depth'] = self.queue_depth()
+        stats['avg_flush_ms'] = (
+            stats['total_flush_ms'] / stats['batches'] if stats['batches'] else 0.0
+        )
+        return stats
+
+    async def _run(self) -> None:
+        while True:
+            message = await self._queue.get()
+            self._pending.append(message)
+            if self._queue.qsize() + len(self._pending) < self.batch_size:
+                self._batch_ready.clear()
+                try:
+                    await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._pending.extend(self._drain_nowait())
+            await self._flush_pending()
+
+    def _drain_nowait(self) -> List[Message]:
+        drained = []
+        while True:
+            try:
+                drained.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                return drained
+
+    async def _flush_pending(self) -> None:
+        async with self._lock:
+            # Visible as in flight before it leaves _pending
+            batch = self._writing = self._pending
+            self._pending = []
+            try:
+                if batch:
+                    # Closes connections the database dropped, or returns them to the pool
+                    await database_sync_to_async(self.write_batch)(batch)
+            finally:
+                self._writing = []
+
+    @timed(DB_SECONDS, operation='write_batch')
+    def write_batch(self, batch: List[Message]) -> None:
+        """Synchronously insert a batch, falling back to row-by-row on failure."""
+        started = time.perf_counter()
+        try:
+            with transaction.atomic():
+                Message.objects.bulk_create(batch, batch_size=self.batch_size)
+                self._record_room_stats(batch)
+            self._stats['written'] += len(batch)
+        except DatabaseError as e:
+            logger.error(f"Bulk insert of {len(batch)} messages failed, retrying individually: {e}")
+            for message in batch:
+                try:
+                    with transaction.atomic():
+                        Message.objects.bulk_create([message])
+                        self._record_room_stats([message])
+                    self._stats['written'] += 1
+                except DatabaseError as row_error:
+                    self._stats['failed'] += 1
+                    logger.error(f"Dropping message {message.id} for room {message.room_id}: {row_error}")
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self._stats['batches'] += 1
+        self._stats['last_flush_ms'] = elapsed_ms
+        self._stats['total_flush_ms'] += elapsed_ms
+        self._stats['max_flush_ms'] = max(self._stats['max_flush_ms'], elapsed_ms)
+
+    @staticmethod
+    def _record_room_stats(batch: List[Message]) -> None:
+        """Update each room's denormalized counters once per batch."""
+        per_room: Dict[int, List] = {}
+        for message in batch:
+            count, latest = per_room.get(message.room_id, (0, message.timestamp))
+            per_room[message.room_id] = (count + 1, max(latest, message.timestamp))
+        for room_id, (count, latest) in per_room.items():
+            Room.record_messages(room_id, count, latest)
+
+    def flush_on_exit(self) -> None:
+        """Persist whatever is still buffered when the process shuts down."""
+        batch = list(self._pending)
+        if self._queue is not None:
+            batch.extend(self._drain_nowait())
+        self._pending = []
+        if not batch:
+            return
+        try:
+            self.write_batch(batch)
+            logger.info(f"Flushed {len(batch)} buffered messages on shutdown")
+        except Exception as e:
+            logger.error(f"Failed to flush {len(batch)} buffered messages on shutdown: {e}")
+
+
+message_ids = MessageIdAllocator()
+message_writer = MessageWriteBehind()
+atexit.register(message_writer.flush_on_exit)
+
+CallbackMetric('chat_write_queue_depth', 'Messages waiting to be persisted.', 'gauge',
+               message_writer.queue_depth)
+CallbackMetric('chat_messages_written_total', 'Messages persisted by the write-behind queue.', 'counter',
+               lambda: message_writer.stats()['written'])
+CallbackMetric('chat_messages_write_failed_total', 'Messages dropped after failed inserts.', 'counter',
+               lambda: message_writer.stats()['failed'])
@@ -0,0 +1,470 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+
+from .metrics import GROUP_SEND_SECONDS, PRESENCE_SECONDS, Counter, timed
+
+logger = logging.getLogger(__name__)
+
+# Constants
+ONLINE_USER_TIMEOUT = 300  # 5 minutes
+CONNECTION_TIMEOUT = getattr(settings, 'CHAT_PRESENCE_CONNECTION_TIMEOUT', 90)  # three missed heartbeats
+PRESENCE_KEY_PREFIX = 'presence'
+PRESENCE_BATCH_WINDOW = getattr(settings, 'CHAT_PRESENCE_BATCH_WINDOW', 0.5)  # seconds
+
+PRESENCE_CHANGES = Counter('chat_presence_changes_total', 'Joins and leaves announced to rooms.', ['change'])
+PRESENCE_BROADCASTS = Counter('chat_presence_broadcasts_total', 'Batched presence events broadcast to rooms.')
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    logger.warning("redis package not available. Presence will be tracked in-process only.")
+    REDIS_AVAILABLE = False
+
+
+def _parse_score(value, default: float) -> tuple:
+    """Parse a Redis-style score bound into (score, exclusive)."""
+    if value is None:
+        return default, False
+    if isinstance(value, str):
+        return float(value.lstrip('(')), value.startswith('(')
+    return float(value), False
+
+
+class LocalSortedSetClient:
+    """In-process stand-in for the subset of the redis-py API presence uses.
+
+    Mirrors ``redis.Redis(decode_responses=True)`` semantics closely enough
+    that a fakeredis client can be swapped in for it.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._keys: Dict[str, Dict] = {}  # sorted sets and hashes alike
+        self._expiry: Dict[str, float] = {}
+
+    def _get(self, name: str, create: bool = False) -> Optional[Dict]:
+        expires_at = self._expiry.get(name)
+        if expires_at is not None and expires_at <= time.time():
+            self._keys.pop(name, None)
+            self._expiry.pop(name, None)
+        if create:
+            return self._keys.setdefault(name, {})
+        return self._keys.get(name)
+
+    def _discard_if_empty(self, name: str) -> None:
+        if not self._keys.get(name, True):
+            self._keys.pop(name, None)
+            self._expiry.pop(name, None)
+
+    def zadd(self, name: str, mapping: Dict[str, float]) -> int:
+        with self._lock:
+            members = self._get(name, create=True)
+            added = sum(1 for member in mapping if member not in members)
+            members.update({member: float(score) for member, score in mapping.items()})
+            return added
+
+    def zrem(self, name: str, *values: str) -> int:
+        with self._lock:
+            members = self._get(name) or {}
+            removed = sum(1 for value in values if members.pop(value, None) is not None)
+            self._discard_if_empty(name)
+            return removed
+
+    def zremrangebyscore(self, name: str, min, max) -> int:
+        with self._lock:
+            members = self._get(name) or {}
+            stale = [member for member, score in members.items() if self._in_range(score, min, max)]
+            for member in stale:
+                del members[member]
+            self._discard_if_empty(name)
+            return len(stale)
+
+    def zrangebyscore(self, name: str, min, max, withscores: bool = False) -> List:
+        with self._lock:
+            members = self._get(name) or {}
+            matched = sorted(
+                ((member, score) for member, score in members.items()
+                 if self._in_range(score, min, max)),
+                key=lambda item: (item[1], item[0])
+            )
+            return matched if withscores else [member for member, _ in matched]
+
+    def zcard(self, name: str) -> int:
+        with self._lock:
+            return len(self._get(name) or {})
+
+    def zscore(self, name: str, value: str) -> Optional[float]:
+        with self._lock:
+            return (self._get(name) or {}).get(value)
+
+    def expire(self, name: str, seconds: int) -> bool:
+        with self._lock:
+            if self._get(name) is None:
+                return False
+            self._expiry[name] = time.time() + seconds
+            return True
+
+    def delete(self, *names: str) -> int:
+        with self._lock:
+            return sum(1 for name in names if self._keys.pop(name, None) is not None)
+
+    def pipeline(self, transaction: bool = True) -> 'LocalPipeline':
+        return LocalPipeline(self)
+
+    @staticmethod
+    def _in_range(score: float, min, max) -> bool:
+        low, low_exclusive = _parse_score(min, float('-inf'))
+        high, high_exclusive = _parse_score(max, float('inf'))
+        above = score > low if low_exclusive else score >= low
+        below = score < high if high_exclusive else score <= high
+        return above and below
+
+
+class LocalPipeline:
+    """Queues commands and runs them under the client lock, like MULTI/EXEC."""
+
+    def __init__(self, client: LocalSortedSetClient):
+        self._client = client
+        self._commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self) -> List:
+        with self._client._lock:
+            results = [method(*args, **kwargs) for method, args, kwargs in self._commands]
+        self._commands = []
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._commands = []
+
+
+# Both scripts take KEYS = (room's user set, user's connection set) and
+# ARGV = (username, connection id, now, connection cutoff, key ttl).
+# Connections whose last heartbeat is older than the cutoff died without
+# disconnecting and are dropped first, so they never hold a user online.
+CONNECT_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', '(' .. ARGV[4])
+local others = redis.call('ZCARD', KEYS[2])
+if redis.call('ZSCORE', KEYS[2], ARGV[2]) then
+    others = others - 1
+end
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[2])
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+if others == 0 then
+    return 1
+end
+return 0
+"""
+DISCONNECT_SCRIPT = """
+redis.call('ZREM', KEYS[2], ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', '(' .. ARGV[4])
+if redis.call('ZCARD', KEYS[2]) > 0 then
+    return 0
+end
+redis.call('DEL', KEYS[2])
+redis.call('ZREM', KEYS[1], ARGV[1])
+return 1
+"""
+
+
+class SortedSetPresence:
+    """Presence stored as one sorted set per room, scored by last-seen time.
+
+    Each user also has a sorted set of their open WebSocket connections,
+    scored by the connection's last heartbeat. A user joins with their first
+    live connection and leaves with their last. A connection whose worker
+    died stops heartbeating and drops out after ``connection_timeout``
+    seconds, so it cannot keep the user online forever. Connect and
+    disconnect each run as one script, so concurrent tabs never lose a user.
+    """
+
+    def __init__(self, client, timeout: int = ONLINE_USER_TIMEOUT,
+                 connection_timeout: int = CONNECTION_TIMEOUT):
+        self.client = client
+        self.timeout = timeout
+        self.connection_timeout = connection_timeout
+        if isinstance(client, LocalSortedSetClient):
+            self._connect_script = self._local_script(self._connect_local)
+            self._disconnect_script = self._local_script(self._disconnect_local)
+        else:
+            self._connect_script = client.register_script(CONNECT_SCRIPT)
+            self._disconnect_script = client.register_script(DISCONNECT_SCRIPT)
+
+    @staticmethod
+    def _key(room_code: str) -> str:
+        return f'{PRESENCE_KEY_PREFIX}:{room_code}'
+
+    @staticmethod
+    def _connections_key(room_code: str, username: str) -> str:
+        return f'{PRESENCE_KEY_PREFIX}:{room_code}:connections:{username}'
+
+    def _script_args(self, room_code: str, username: str, connection_id: str) -> Dict:
+        now = time.time()
+        return {
+            'keys': [self._key(room_code), self._connections_key(room_code, username)],
+            'args': [username, connection_id, now, now - self.connection_timeout, self.timeout],
+        }
+
+    def connect(self, room_code: str, username: str, connection_id: str) -> bool:
+        """Register a WebSocket connection; True if the user just came online."""
+        return bool(int(self._connect_script(**self._script_args(room_code, username, connection_id))))
+
+    def disconnect(self, room_code: str, username: str, connection_id: str) -> bool:
+        """Drop a WebSocket connection; True if it was the user's last live one."""
+        return bool(int(self._disconnect_script(**self._script_args(room_code, username, connection_id))))
+
+    def mark_online(self, room_code: str, username: str, connection_id: Optional[str] = None) -> None:
+        key = self._key(room_code)
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.zadd(key, {username: now})
+        pipe.expire(key, self.timeout)
+        if connection_id is not None:
+            # The connection's heartbeat keeps it, and only it, alive
+            connections_key = self._connections_key(room_code, username)
+            pipe.zadd(connections_key, {connection_id: now})
+            pipe.expire(connections_key, self.timeout)
+        pipe.execute()
+
+    def _local_script(self, implementation):
+        # The in-process client cannot run Lua; the same steps under its lock are just as atomic
+        def run(keys: List[str], args: List) -> int:
+            with self.client._lock:
+                return implementation(keys, args)
+        return run
+
+    def _connect_local(self, keys: List[str], args: List) -> int:
+        users_key, connections_key = keys
+        username, connection_id, now, cutoff, ttl = args
+        self.client.zremrangebyscore(connections_key, '-inf', f'({cutoff}')
+        others = self.client.zcard(connections_key)
+        if self.client.zscore(connections_key, connection_id) is not None:
+            others -= 1
+        self.client.zadd(connections_key, {connection_id: now})
+        self.client.zadd(users_key, {username: now})
+        self.client.expire(connections_key, ttl)
+        self.client.expire(users_key, ttl)
+        return 1 if others == 0 else 0
+
+    def _disconnect_local(self, keys: List[str], args: List) -> int:
+        users_key, connections_key = keys
+        username, connection_id, now, cutoff, ttl = args
+        self.client.zrem(connections_key, connection_id)
+        self.client.zremrangebyscore(connections_key, '-inf', f'({cutoff}')
+        if self.client.zcard(connections_key) > 0:
+            return 0
+        self.client.delete(connections_key)
+        self.client.zrem(users_key, username)
+        return 1
+
+    def remove(self, room_code: str, username: str) -> None:
+        pipe = self.client.pipeline()
+        pipe.zrem(self._key(room_code), username)
+        pipe.delete(self._connections_key(room_code, username))
+        pipe.execute()
+
+    def online_users(self, room_code: str) -> List[str]:
+        return self.online_users_bulk([room_code])[room_code]
+
+    def online_users_bulk(self, room_codes: Iterable[str]) -> Dict[str, List[str]]:
+        """Fetch online users for many rooms in a single round trip."""
+        room_codes = list(room_codes)
+        cutoff = time.time() - self.timeout
+        pipe = self.client.pipeline(transaction=False)
+        for room_code in room_codes:
+            key = self._key(room_code)
+            pipe.zremrangebyscore(key, '-inf', f'({cutoff}')
+            pipe.zrangebyscore(key, cutoff, '+inf')
+        results = pipe.execute()
+        return {
+            room_code: list(results[index * 2 + 1])
+            for index, room_code in enumerate(room_codes)
+        }
+
+
+_presence: Optional[SortedSetPresence] = None
+
+
+def get_presence() -> SortedSetPresence:
+    """Return the process-wide presence backend, Redis-backed when configured."""
+    global _presence
+    if _presence is None:
+        redis_url = getattr(settings, 'PRESENCE_REDIS_URL', None)
+        if redis_url and REDIS_AVAILABLE:
+            client = redis.Redis.from_url(redis_url, decode_responses=True)
+        else:
+            client = LocalSortedSetClient()
+        _presence = SortedSetPresence(client)
+    return _presence
+
+
+def set_presence_client(client) -> None:
+    """Swap the presence client, e.g. for a fakeredis instance in tests."""
+    global _presence
+    _presence = SortedSetPresence(client)
+
+
+class OnlineUserTracker:
+    #Handles online user tracking with improved error handling and cleanup.
+    @staticmethod
+    @timed(PRESENCE_SECONDS, operation='mark_online')
+    def mark_user_online(room_code: str, username: str, connection_id: Optional[str] = None) -> bool:
+        """Mark a user (and, for WebSocket heartbeats, their connection) as online in a room."""
+        try:
+            if not room_code or not username:
+                return False
+
+            get_presence().mark_online(room_code, username, connection_id)
+            return True
+        except Exception as e:
+            logger.error(f"Error marking user {username} online in room {room_code}: {e}")
+            return False
+
+    @staticmethod
+    @timed(PRESENCE_SECONDS, operation='connect')
+    def user_connected(room_code: str, username: str, connection_id: str) -> bool:
+        """Record a new WebSocket connection; True if the user just came online."""
+        try:
+            return get_presence().connect(room_code, username, connection_id)
+        except Exception as e:
+            logger.error(f"Error connecting user {username} in room {room_code}: {e}")
+            return False
+
+    @staticmethod
+    @timed(PRESENCE_SECONDS, operation='disconnect')
+    def user_disconnected(room_code: str, username: str, connection_id: str) -> bool:
+        """Record a closed WebSocket connection; True if the user went offline."""
+        try:
+            return get_presence().disconnect(room_code, username, connection_id)
+        except Exception as e:
+            logger.error(f"Error disconnecting user {username} in room {room_code}: {e}")
+            return False
+
+    @staticmethod
+    @timed(PRESENCE_SECONDS, operation='online_users')
+    def get_online_users(room_code: str) -> List[str]:
+        """Get list of currently online users in a room."""
+        try:
+            if not room_code:
+                return []
+
+            return get_presence().online_users(room_code)
+        except Exception as e:
+            logger.error(f"Error getting online users for room {room_code}: {e}")
+            return []
+
+    @staticmethod
+    @timed(PRESENCE_SECONDS, operation='online_users_bulk')
+    def get_online_users_bulk(room_codes: Iterable[str]) -> Dict[str, List[str]]:
+        """Get online users for several rooms with one backend round trip."""
+        room_codes = [code for code in room_codes if code]
+        try:
+            return get_presence().online_users_bulk(room_codes)
+        except Exception as e:
+            logger.error(f"Error getting online users for rooms {room_codes}: {e}")
+            return {code: [] for code in room_codes}
+
+    @staticmethod
+    @timed(PRESENCE_SECONDS, operation='remove')
+    def remove_user(room_code: str, username: str) -> bool:
+        """Remove a specific user from online tracking."""
+        try:
+            if not room_code or not username:
+                return False
+
+            get_presence().remove(room_code, username)
+            return True
+        except Exception as e:
+            logger.error(f"Error removing user {username} from room {room_code}: {e}")
+            return False
+
+
+class PresenceBatcher:
+    """Collects joins and leaves per room group and announces them together.
+
+    The first change in a room opens a window of ``window`` seconds, and
+    everything that happens in it goes out as one ``presence_event``, so a
+    reconnect storm costs one broadcast per window instead of one per user.
+    The window is not extended by later changes, so a long storm still
+    announces every ``window`` seconds. A user who joins and leaves within
+    the same window is never announced.
+    """
+
+    def __init__(self, window: float = PRESENCE_BATCH_WINDOW):
+        self.window = window
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # group -> (channel layer, {'joined': {...}, 'left': {...}}); dicts keep arrival order
+        self._pending: Dict[str, tuple] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def joined(self, channel_layer, group: str, username: str) -> None:
+        self._add(channel_layer, group, username, 'joined', 'left')
+
+    def left(self, channel_layer, group: str, username: str) -> None:
+        self._add(channel_layer, group, username, 'left', 'joined')
+
+    def _add(self, channel_layer, group: str, username: str, change: str, opposite: str) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Tasks from an earlier event loop (e.g. a previous test) are gone
+            self._loop = loop
+            self._pending.clear()
+            self._tasks.clear()
+
+        PRESENCE_CHANGES.labels(change).inc()
+        _, changes = self._pending.setdefault(group, (channel_layer, {'joined': {}, 'left': {}}))
+        if username in changes[opposite]:
+            # Cancels out a change nobody has been told about yet
+            del changes[opposite][username]
+        else:
+            changes[change][username] = None
+
+        if group not in self._tasks:
+            self._tasks[group] = loop.create_task(self._flush_later(group))
+
+    async def _flush_later(self, group: str) -> None:
+        await asyncio.sleep(self.window)
+        del self._tasks[group]
+        channel_layer, changes = self._pending.pop(group)
+        if changes['joined'] or changes['left']:
+            await self._send(channel_layer, group, list(changes['joined']), list(changes['left']))
+
+    @staticmethod
+    @timed(GROUP_SEND_SECONDS)
+    async def _send(channel_layer, group: str, joined: List[str], left: List[str]) -> None:
+        try:
+            await channel_layer.group_send(group, {'type': 'presence_event', 'joined': joined, 'left': left})
+            PRESENCE_BROADCASTS.inc()
+        except Exception as e:
+            logger.error(f"Error announcing presence to {group}: {e}")
+
+    async def flush(self) -> None:
+        """Announce everything pending now, e.g. before shutdown."""
+        for task in list(self._tasks.values()):
+            task.cancel()
+        pending, self._pending = self._pending, {}
+        self._tasks.clear()
+        for group, (channel_layer, changes) in pending.items():
+            if changes['joined'] or changes['left']:
+                await self._send(channel_layer, group, list(changes['joined']), list(changes['left']))
+
+
+presence_batcher = PresenceBatcher()
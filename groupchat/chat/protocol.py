@@ -0,0 +1,198 @@
+"""Wire formats for ``ChatConsumer``, negotiated via ``Sec-WebSocket-Protocol``.
+
+JSON text frames remain the default. Clients that offer
+``MSGPACK_SUBPROTOCOL`` get binary MessagePack frames instead, where chat
+messages use short field codes, integer epoch-millisecond timestamps and
+usernames interned per connection:
+
+    {"i": id, "u": 3, "n": "alice", "m": "hello", "t": 1735689600000}
+
+``n`` is only present the first time username 3 is sent on the
+connection; later frames carry just the index. Other frames keep their
+JSON shape, with any chat messages inside them (history, batch) compacted
+the same way.
+"""
+import json
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Constants
+MSGPACK_SUBPROTOCOL = 'chat.msgpack.v1'
+MAX_INTERNED_USERNAMES = 4096  # per connection; later names are sent in full
+SHARED_FRAME_CACHE_SIZE = 2048  # recent broadcasts kept encoded per process
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    logger.warning("msgpack not available. Only the JSON wire format will be offered.")
+    MSGPACK_AVAILABLE = False
+
+Frame = Union[str, bytes]
+
+
+class SharedFrameCache:
+    """Encoded broadcasts shared by every consumer in this process.
+
+    A broadcast is encoded once by whichever local consumer gets it
+    first, and everyone else forwards the same object. Entries expire in
+    arrival order; a broadcast is only hot for as long as it takes to fan
+    out, so recency tracking would not buy anything.
+    """
+
+    def __init__(self, max_entries: int = SHARED_FRAME_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._frames: 'OrderedDict[Hashable, Frame]' = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0}
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Frame]) -> Frame:
+        frame = self._frames.get(key)
+        if frame is not None:
+            self._stats['hits'] += 1
+            return frame
+
+        self._stats['misses'] += 1
+        frame = self._frames[key] = factory()
+        if len(self._frames) > self.max_entries:
+            self._frames.popitem(last=False)
+        return frame
+
+    def clear(self) -> None:
+        self._frames.clear()
+
+    def stats(self) -> Dict:
+        return {**self._stats, 'entries': len(self._frames)}
+
+
+shared_frames = SharedFrameCache()
+
+
+class JsonCodec:
+    """The default text format: one JSON object per frame."""
+
+    subprotocol: Optional[str] = None
+
+    def encode(self, frame: Dict) -> Frame:
+        return json.dumps(frame)
+
+    def encode_message(self, message: Dict, encoded: Optional[str] = None) -> Frame:
+        """Encode one chat message, reusing the broadcast's JSON frame when it carried one."""
+        message_id = message.get('id')
+        if message_id is None:
+            return encoded if encoded is not None else json.dumps(message)
+        return shared_frames.get_or_create(
+            ('json', message_id), lambda: encoded if encoded is not None else json.dumps(message)
+        )
+
+    def encode_messages(self, messages: List[Dict]) -> Frame:
+        if len(messages) == 1:
+            return self.encode_message(messages[0])
+        return json.dumps({'type': 'batch', 'messages': messages})
+
+    def decode(self, text_data: Optional[str], bytes_data: Optional[bytes]) -> Dict:
+        return json.loads(text_data if text_data is not None else bytes_data)
+
+
+def _epoch_ms(timestamp) -> Optional[int]:
+    if timestamp is None or isinstance(timestamp, int):
+        return timestamp
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    return int(timestamp.timestamp() * 1000)
+
+
+class MsgpackCodec:
+    """Compact binary format; one instance per connection for username interning."""
+
+    subprotocol = MSGPACK_SUBPROTOCOL
+
+    def __init__(self, max_interned: int = MAX_INTERNED_USERNAMES):
+        self.max_interned = max_interned
+        self._usernames: Dict[str, int] = {}
+        self._packed_refs: Dict[str, bytes] = {}  # username -> packed 'u' field
+
+    def _user_fields(self, username: str) -> Dict:
+        index = self._usernames.get(username)
+        if index is not None:
+            return {'u': index}
+        if len(self._usernames) < self.max_interned:
+            index = self._usernames[username] = len(self._usernames)
+            return {'u': index, 'n': username}
+        return {'n': username}
+
+    def compact_message(self, message: Dict) -> Dict:
+        return {
+            'i': message.get('id'),
+            'm': message['message'],
+            't': _epoch_ms(message.get('timestamp')),
+            **self._user_fields(message['username']),
+        }
+
+    def _compact_all(self, messages: Iterable[Dict]) -> List[Dict]:
+        return [self.compact_message(message) for message in messages]
+
+    @staticmethod
+    def _pack_shared_fields(message: Dict) -> bytes:
+        packer = msgpack.Packer()
+        return b''.join(packer.pack(item) for item in (
+            'i', message.get('id'), 'm', message['message'], 't', _epoch_ms(message.get('timestamp')),
+        ))
+
+    def encode_message(self, message: Dict, encoded: Optional[str] = None) -> Frame:
+        """Encode one chat message from the process-wide packed fields.
+
+        A MessagePack map is a header followed by its packed key/value
+        pairs, so only the header and this connection's username fields
+        are packed here; id, message and timestamp are packed once per
+        process. The result is identical to packing ``compact_message``.
+        ``encoded`` is the broadcast's JSON frame and is not used here.
+        """
+        message_id = message.get('id')
+        if message_id is None:
+            return msgpack.packb(self.compact_message(message))
+        shared = shared_frames.get_or_create(
+            ('msgpack', message_id), lambda: self._pack_shared_fields(message)
+        )
+        username = message['username']
+        ref = self._packed_refs.get(username)
+        if ref is not None:
+            return b'\x84' + shared + ref  # fixmap of i, m, t, u
+
+        user_fields = self._user_fields(username)
+        if 'u' in user_fields:
+            self._packed_refs[username] = msgpack.packb('u') + msgpack.packb(user_fields['u'])
+        # fixmap header: at most 5 entries, so the count fits in the low nibble
+        header = bytes((0x80 | (3 + len(user_fields)),))
+        return header + shared + b''.join(msgpack.packb(item) for pair in user_fields.items() for item in pair)
+
+    def encode(self, frame: Dict) -> Frame:
+        if 'type' not in frame and 'message' in frame:
+            return self.encode_message(frame)
+        if 'messages' in frame:
+            frame = {**frame, 'messages': self._compact_all(frame['messages'])}
+        return msgpack.packb(frame)
+
+    def encode_messages(self, messages: List[Dict]) -> Frame:
+        if len(messages) == 1:
+            return self.encode_message(messages[0])
+        return msgpack.packb({'type': 'batch', 'messages': self._compact_all(messages)})
+
+    def decode(self, text_data: Optional[str], bytes_data: Optional[bytes]) -> Dict:
+        # Clients may still send JSON text over a binary connection
+        if bytes_data is None:
+            return json.loads(text_data)
+        data = msgpack.unpackb(bytes_data)
+        if 'm' in data and 'message' not in data:
+            data['message'] = data.pop('m')
+        return data
+
+
+def negotiate(subprotocols: Iterable[str]):
+    """Pick the codec for a connection from the subprotocols the client offered."""
+    if MSGPACK_AVAILABLE and MSGPACK_SUBPROTOCOL in (subprotocols or ()):
+        return MsgpackCodec()
+    return JsonCodec()
@@ -0,0 +1,235 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+from .metrics import Counter
+from .presence import REDIS_AVAILABLE
+
+if REDIS_AVAILABLE:
+    import redis
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimit(NamedTuple):
+    rate: float  # tokens refilled per second
+    burst: int   # bucket capacity
+
+
+# Constants
+CONNECTION_MESSAGE_LIMIT = RateLimit(*getattr(settings, 'CHAT_RATE_LIMIT_CONNECTION', (5, 10)))
+USER_MESSAGE_LIMIT = RateLimit(*getattr(settings, 'CHAT_RATE_LIMIT_USER', (10, 20)))
+IP_MESSAGE_LIMIT = RateLimit(*getattr(settings, 'CHAT_RATE_LIMIT_IP', (20, 40)))
+ROOM_CREATION_LIMIT = RateLimit(*getattr(settings, 'CHAT_RATE_LIMIT_ROOM_CREATION', (0.1, 5)))
+RATELIMIT_KEY_PREFIX = 'ratelimit'
+LOCAL_MAX_BUCKETS = 100000
+
+RATE_LIMITED = Counter('chat_rate_limited_total', 'Requests rejected by a rate limit.', ['scope'])
+
+# Refills and takes from every bucket atomically. Nothing is taken unless
+# all buckets have enough tokens. Returns the seconds to wait as a string,
+# because Redis truncates Lua numbers to integers.
+TOKEN_BUCKET_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local cost = tonumber(ARGV[1])
+local tokens = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local available = tonumber(state[1]) or burst
+    local last = tonumber(state[2]) or now
+    available = math.min(burst, available + math.max(0, now - last) * rate)
+    if available < cost then
+        wait = math.max(wait, (cost - available) / rate)
+    end
+    tokens[i] = available
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    local remaining = tokens[i]
+    if wait == 0 then
+        remaining = remaining - cost
+    end
+    redis.call('HSET', key, 'tokens', tostring(remaining), 'ts', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+return tostring(wait)
+"""
+
+
+def _refill(tokens: float, last: float, now: float, limit: RateLimit) -> float:
+    return min(limit.burst, tokens + max(0.0, now - last) * limit.rate)
+
+
+class TokenBucket:
+    """A single in-process bucket, e.g. for one WebSocket connection."""
+
+    def __init__(self, limit: RateLimit):
+        self.limit = limit
+        self.tokens = float(limit.burst)
+        self.updated = time.monotonic()
+
+    def take(self, cost: float = 1) -> float:
+        """Take ``cost`` tokens; returns 0 on success or the seconds to wait."""
+        now = time.monotonic()
+        self.tokens = _refill(self.tokens, self.updated, now, self.limit)
+        self.updated = now
+        if self.tokens < cost:
+            return (cost - self.tokens) / self.limit.rate
+        self.tokens -= cost
+        return 0.0
+
+
+class LocalTokenBuckets:
+    """Keyed buckets for a single process, bounded to the most recent keys."""
+
+    def __init__(self, max_buckets: int = LOCAL_MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._lock = threading.Lock()
+        self._buckets: 'OrderedDict[str, list]' = OrderedDict()  # key -> [tokens, updated]
+
+    def acquire(self, buckets: Sequence[Tuple[str, RateLimit]], cost: float = 1) -> float:
+        now = time.monotonic()
+        with self._lock:
+            states = []
+            wait = 0.0
+            for key, limit in buckets:
+                state = self._buckets.get(key)
+                if state is None:
+                    state = self._buckets[key] = [float(limit.burst), now]
+                else:
+                    self._buckets.move_to_end(key)
+                state[0] = _refill(state[0], state[1], now, limit)
+                state[1] = now
+                if state[0] < cost:
+                    wait = max(wait, (cost - state[0]) / limit.rate)
+                states.append(state)
+
+            if not wait:
+                for state in states:
+                    state[0] -= cost
+
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class RedisTokenBuckets:
+    """Buckets shared by every worker, updated by one Lua script call.
+
+    Falls back to per-process buckets while Redis is unreachable.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.script = client.register_script(TOKEN_BUCKET_SCRIPT)
+        self.fallback = LocalTokenBuckets()
+
+    def acquire(self, buckets: Sequence[Tuple[str, RateLimit]], cost: float = 1) -> float:
+        keys = [key for key, _ in buckets]
+        args = [cost]
+        for _, limit in buckets:
+            args.extend([limit.rate, limit.burst])
+        try:
+            return float(self.script(keys=keys, args=args))
+        except redis.RedisError as e:
+            logger.warning(f"Rate limiting locally, Redis unavailable: {e}")
+            return self.fallback.acquire(buckets, cost)
+
+
+_limiter = None
+
+
+def get_rate_limiter():
+    """Return the process-wide bucket store, Redis-backed when configured."""
+    global _limiter
+    if _limiter is None:
+        redis_url = getattr(settings, 'RATELIMIT_REDIS_URL', None)
+        if redis_url and REDIS_AVAILABLE:
+            _limiter = RedisTokenBuckets(redis.Redis.from_url(redis_url, decode_responses=True))
+        else:
+            _limiter = LocalTokenBuckets()
+    return _limiter
+
+
+def set_rate_limit_client(client) -> None:
+    """Swap the Redis client, e.g. for a fakeredis instance in tests."""
+    global _limiter
+    _limiter = RedisTokenBuckets(client) if client is not None else LocalTokenBuckets()
+
+
+def client_ip(remote_addr: Optional[str], forwarded_for: Optional[str]) -> Optional[str]:
+    """The address that reached the outermost of ``CHAT_TRUSTED_PROXY_COUNT`` proxies.
+
+    Each proxy appends the address it received the request from to
+    X-Forwarded-For, so the Nth entry from the right was written by our own
+    outermost proxy. Entries further left come from the client and are
+    ignored, as is the whole header when no proxies are trusted.
+    """
+    trusted = getattr(settings, 'CHAT_TRUSTED_PROXY_COUNT', 0)
+    if trusted <= 0 or not forwarded_for:
+        return remote_addr
+    hops = [hop.strip() for hop in forwarded_for.split(',') if hop.strip()]
+    if len(hops) < trusted:
+        return remote_addr
+    return hops[-trusted]
+
+
+def request_ip(request) -> Optional[str]:
+    return client_ip(request.META.get('REMOTE_ADDR'), request.META.get('HTTP_X_FORWARDED_FOR'))
+
+
+def scope_ip(scope) -> Optional[str]:
+    client = scope.get('client')
+    # Repeated headers are one list, in order
+    forwarded_for = ','.join(
+        value.decode('latin-1') for name, value in scope.get('headers', ()) if name == b'x-forwarded-for'
+    )
+    return client_ip(client[0] if client else None, forwarded_for)
+
+
+def _key(*parts: str) -> str:
+    return ':'.join((RATELIMIT_KEY_PREFIX,) + parts)
+
+
+class RateLimiter:
+    # Throttles message ingress and room creation without touching the database.
+    @staticmethod
+    def _acquire(scope: str, buckets: Sequence[Tuple[str, RateLimit]]) -> float:
+        try:
+            wait = get_rate_limiter().acquire(buckets)
+        except Exception as e:
+            # Never turn a limiter failure into an outage
+            logger.error(f"Error checking {scope} rate limit: {e}")
+            return 0.0
+        if wait:
+            RATE_LIMITED.labels(scope).inc()
+        return wait
+
+    @staticmethod
+    def check_message(username: str, ip: Optional[str]) -> float:
+        """Seconds to wait before ``username`` at ``ip`` may send, or 0."""
+        buckets = [(_key('user', username), USER_MESSAGE_LIMIT)]
+        if ip:
+            buckets.append((_key('ip', ip), IP_MESSAGE_LIMIT))
+        return RateLimiter._acquire('message', buckets)
+
+    @staticmethod
+    def check_room_creation(ip: Optional[str]) -> float:
+        """Seconds to wait before ``ip`` may create another room, or 0."""
+        if not ip:
+            return 0.0
+        return RateLimiter._acquire('room_creation', [(_key('create', ip), ROOM_CREATION_LIMIT)])
+
+    @staticmethod
+    def retry_after(wait: float) -> int:
+        return max(1, math.ceil(wait))
@@ -0,0 +1,261 @@
+import asyncio
+import json
+import logging
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from .history import encode_history_frame
+from .metrics import CallbackMetric
+
+logger = logging.getLogger(__name__)
+
+# Constants
+RECENT_MESSAGES_PER_ROOM = getattr(settings, 'CHAT_RECENT_MESSAGES_PER_ROOM', 50)
+RECENT_MAX_ROOMS = getattr(settings, 'CHAT_RECENT_MAX_ROOMS', 1000)
+RECENT_MAX_BYTES = getattr(settings, 'CHAT_RECENT_MAX_BYTES', 16 * 1024 * 1024)
+
+
+class _RoomBuffer:
+    __slots__ = ('messages', 'ids', 'size', 'complete', 'truncated', 'frame', 'frame_limit')
+
+    def __init__(self):
+        self.messages = deque()  # (message, size) pairs, oldest first
+        self.ids = set()
+        self.size = 0
+        # False until the buffer has been primed from the database; until then
+        # it only holds messages seen since, so it cannot be used for replay.
+        self.complete = False
+        # True when older messages exist in the database than the buffer holds
+        self.truncated = False
+        # Encoded history frame shared by every joiner until the next append
+        self.frame: Optional[str] = None
+        self.frame_limit = 0
+
+
+class RecentMessageCache:
+    """Per-room ring buffers of recently broadcast messages, evicted LRU.
+
+    Joiners are served from the buffer; only a cold room (or one evicted to
+    stay under the room/byte caps) goes to the database, and concurrent cold
+    misses for the same room share a single load.
+    """
+
+    def __init__(self, per_room: int = RECENT_MESSAGES_PER_ROOM,
+                 max_rooms: int = RECENT_MAX_ROOMS,
+                 max_bytes: int = RECENT_MAX_BYTES):
+        self.per_room = per_room
+        self.max_rooms = max_rooms
+        self.max_bytes = max_bytes
+        self._rooms: "OrderedDict[str, _RoomBuffer]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Task] = {}
+        self._bytes = 0
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, room_code: str, limit: Optional[int] = None) -> Optional[List[Dict]]:
+        """Return the newest ``limit`` buffered messages, or None on a cold miss."""
+        buffer = self._lookup(room_code)
+        if buffer is None:
+            return None
+        messages = [message for message, _ in buffer.messages]
+        return messages[-limit:] if limit else messages
+
+    def history_frame(self, room_code: str, limit: int) -> Optional[str]:
+        """Return the encoded join-replay frame, or None on a cold miss."""
+        buffer = self._lookup(room_code)
+        if buffer is None:
+            return None
+        return self._frame_for(buffer, limit)
+
+    async def get_or_load(self, room_code: str,
+                          loader: Callable[[], Awaitable[List[Dict]]],
+                          limit: Optional[int] = None) -> List[Dict]:
+        """Serve from the buffer, loading it through ``loader`` on a cold miss."""
+        messages = self.get(room_code, limit)
+        if messages is not None:
+            return messages
+
+        messages = await self._await_load(room_code, loader)
+        return messages[-limit:] if limit else messages
+
+    async def get_or_load_frame(self, room_code: str,
+                                loader: Callable[[], Awaitable[List[Dict]]],
+                                limit: int) -> str:
+        """Like ``history_frame`` but loads the buffer through ``loader`` when cold."""
+        frame = self.history_frame(room_code, limit)
+        if frame is not None:
+            return frame
+
+        buffer, messages = await self._load_buffer(room_code, loader)
+        if buffer is not None:
+            return self._frame_for(buffer, limit)
+        # Evicted again before we could read it back; encode just for this joiner
+        return encode_history_frame(self._page(messages, limit, len(messages) >= limit))
+
+    async def get_or_load_page(self, room_code: str,
+                               loader: Callable[[], Awaitable[List[Dict]]],
+                               limit: int) -> Dict:
+        """The join-replay page itself, for connections that encode their own frames."""
+        buffer = self._lookup(room_code)
+        if buffer is not None:
+            return self._page_for(buffer, limit)
+
+        buffer, messages = await self._load_buffer(room_code, loader)
+        if buffer is not None:
+            return self._page_for(buffer, limit)
+        return self._page(messages, limit, len(messages) >= limit)
+
+    def since(self, room_code: str, after: int) -> Tuple[List[Dict], bool]:
+        """Buffered messages with an id above ``after``, oldest first.
+
+        The flag says whether they are the whole gap, which needs a primed
+        buffer that reaches back to ``after`` (or holds the room's entire
+        history). Messages still waiting in the write-behind queue are
+        included either way, so callers merge them into database results.
+        """
+        buffer = self._rooms.get(room_code)
+        if buffer is None:
+            self._stats['misses'] += 1
+            return [], False
+
+        messages = sorted((message for message, _ in buffer.messages if message['id'] > after),
+                          key=lambda message: message['id'])
+        reaches_back = not buffer.truncated or (buffer.messages and buffer.messages[0][0]['id'] <= after)
+        covered = bool(buffer.complete and reaches_back)
+        self._stats['hits' if covered else 'misses'] += 1
+        return messages, covered
+
+    def prime(self, room_code: str, messages: List[Dict]) -> None:
+        """Seed a room's buffer from the database, oldest message first.
+
+        Messages broadcast while the load was in flight are kept and merged.
+        """
+        buffer = self._rooms.get(room_code)
+        seen = [message for message, _ in buffer.messages] if buffer else []
+        if buffer is not None:
+            self._drop(room_code)
+
+        buffer = _RoomBuffer()
+        self._rooms[room_code] = buffer
+        merged = {message['id']: message for message in messages}
+        merged.update((message['id'], message) for message in seen)
+        for message_id in sorted(merged):
+            self._push(buffer, merged[message_id])
+        buffer.truncated = buffer.truncated or len(messages) >= self.per_room
+        buffer.complete = True
+        self._evict(keep=room_code)
+
+    def append(self, room_code: str, message: Dict) -> None:
+        """Record a broadcast message; repeated calls for the same id are ignored."""
+        buffer = self._rooms.get(room_code)
+        if buffer is None:
+            buffer = _RoomBuffer()
+            self._rooms[room_code] = buffer
+        elif message['id'] in buffer.ids:
+            return
+
+        self._rooms.move_to_end(room_code)
+        self._push(buffer, message)
+        self._evict(keep=room_code)
+
+    def discard(self, room_code: str) -> None:
+        if room_code in self._rooms:
+            self._drop(room_code)
+
+    def stats(self) -> Dict:
+        stats = dict(self._stats)
+        stats['rooms'] = len(self._rooms)
+        stats['bytes'] = self._bytes
+        return stats
+
+    def _lookup(self, room_code: str) -> Optional[_RoomBuffer]:
+        buffer = self._rooms.get(room_code)
+        if buffer is None or not buffer.complete:
+            self._stats['misses'] += 1
+            return None
+
+        self._stats['hits'] += 1
+        self._rooms.move_to_end(room_code)
+        return buffer
+
+    async def _await_load(self, room_code: str,
+                          loader: Callable[[], Awaitable[List[Dict]]]) -> List[Dict]:
+        task = self._loading.get(room_code)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._load(room_code, loader))
+            self._loading[room_code] = task
+        return await asyncio.shield(task)
+
+    async def _load(self, room_code: str,
+                    loader: Callable[[], Awaitable[List[Dict]]]) -> List[Dict]:
+        try:
+            messages = await loader()
+            self.prime(room_code, messages)
+            return [message for message, _ in self._rooms[room_code].messages]
+        finally:
+            self._loading.pop(room_code, None)
+
+    async def _load_buffer(self, room_code: str,
+                           loader: Callable[[], Awaitable[List[Dict]]]) -> Tuple[Optional[_RoomBuffer], List[Dict]]:
+        messages = await self._await_load(room_code, loader)
+        buffer = self._rooms.get(room_code)
+        return (buffer if buffer is not None and buffer.complete else None), messages
+
+    @staticmethod
+    def _page(messages: List[Dict], limit: int, truncated: bool) -> Dict:
+        recent = messages[-limit:]
+        has_more = truncated or len(messages) > limit
+        return {
+            'messages': recent,
+            'has_more': has_more,
+            'next_before': recent[0]['id'] if has_more and recent else None,
+        }
+
+    def _page_for(self, buffer: _RoomBuffer, limit: int) -> Dict:
+        return self._page([message for message, _ in buffer.messages], limit, buffer.truncated)
+
+    def _frame_for(self, buffer: _RoomBuffer, limit: int) -> str:
+        if buffer.frame is None or buffer.frame_limit != limit:
+            buffer.frame = encode_history_frame(self._page_for(buffer, limit))
+            buffer.frame_limit = limit
+        return buffer.frame
+
+    def _push(self, buffer: _RoomBuffer, message: Dict) -> None:
+        size = len(json.dumps(message))
+        buffer.frame = None
+        buffer.messages.append((message, size))
+        buffer.ids.add(message['id'])
+        buffer.size += size
+        self._bytes += size
+        while len(buffer.messages) > self.per_room:
+            old, old_size = buffer.messages.popleft()
+            buffer.truncated = True
+            buffer.ids.discard(old['id'])
+            buffer.size -= old_size
+            self._bytes -= old_size
+
+    def _drop(self, room_code: str) -> None:
+        buffer = self._rooms.pop(room_code)
+        self._bytes -= buffer.size
+
+    def _evict(self, keep: str) -> None:
+        while len(self._rooms) > self.max_rooms or self._bytes > self.max_bytes:
+            oldest = next(iter(self._rooms))
+            if oldest == keep:
+                if len(self._rooms) == 1:
+                    return
+                self._rooms.move_to_end(keep)
+                continue
+            self._drop(oldest)
+            self._stats['evictions'] += 1
+
+
+recent_messages = RecentMessageCache()
+
+CallbackMetric('chat_recent_cache_hits_total', 'Recent-message cache hits.', 'counter',
+               lambda: recent_messages.stats()['hits'])
+CallbackMetric('chat_recent_cache_misses_total', 'Recent-message cache misses.', 'counter',
+               lambda: recent_messages.stats()['misses'])
+CallbackMetric('chat_recent_cache_bytes', 'Approximate size of the recent-message cache.', 'gauge',
+               lambda: recent_messages.stats()['bytes'])
@@ -0,0 +1,154 @@
+import re
+from typing import Dict, List, Optional
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from .history import serialize_message
+from .metrics import DB_SECONDS, timed
+from .models import Message
+
+# Constants
+SEARCH_TABLE = 'chat_message_fts'  # created by migration 0007 where FTS5 is available
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+MAX_SEARCH_OFFSET = 1000  # deeper pages than this are not useful for ranked results
+MAX_SEARCH_TERMS = 8
+MIN_PREFIX_LENGTH = 2  # matches the index's shortest prefix size
+BACKFILL_BATCH_SIZE = 5000
+
+_index_ready: Dict[tuple, bool] = {}
+
+
+def search_index_ready(using: str = DEFAULT_DB_ALIAS) -> bool:
+    """True when the database has the FTS5 message index."""
+    connection = connections[using]
+    key = (using, connection.settings_dict['NAME'])
+    if key not in _index_ready:
+        _index_ready[key] = (
+            connection.vendor == 'sqlite' and SEARCH_TABLE in connection.introspection.table_names()
+        )
+    return _index_ready[key]
+
+
+def search_terms(query: str) -> List[str]:
+    """Split user input into plain word terms; FTS5 syntax is never passed through."""
+    return re.findall(r'\w+', query.lower())[:MAX_SEARCH_TERMS]
+
+
+def build_match_expression(room_id: int, terms: List[str]) -> str:
+    """FTS5 MATCH expression: every term, the last one as a prefix, within one room."""
+    phrases = [f'"{term}"' for term in terms]
+    # Single-character prefixes expand to most of the vocabulary
+    if len(terms[-1]) >= MIN_PREFIX_LENGTH:
+        phrases[-1] += '*'
+    return f'room_id : "{int(room_id)}" AND content : ({" ".join(phrases)})'
+
+
+class MessageSearch:
+    """Ranked full-text search over one room's messages.
+
+    Uses the FTS5 index where the database has one, ordered by BM25 rank
+    and then newest first. Elsewhere it falls back to matching every term
+    with ``icontains``, newest first, which scans the room's messages.
+    """
+
+    @staticmethod
+    def clamp(offset: Optional[int], limit: Optional[int]) -> tuple:
+        limit = max(1, min(int(limit), MAX_SEARCH_PAGE_SIZE)) if limit else SEARCH_PAGE_SIZE
+        offset = max(0, min(int(offset or 0), MAX_SEARCH_OFFSET))
+        return offset, limit
+
+    @staticmethod
+    @timed(DB_SECONDS, operation='search')
+    def search(room_id: int, query: str, offset: Optional[int] = None,
+               limit: Optional[int] = None) -> Dict:
+        offset, limit = MessageSearch.clamp(offset, limit)
+        terms = search_terms(query)
+        ranked = search_index_ready()
+        if not terms:
+            rows = []
+        elif ranked:
+            rows = MessageSearch._fts_rows(room_id, terms, offset, limit + 1)
+        else:
+            rows = MessageSearch._scan_rows(room_id, terms, offset, limit + 1)
+
+        has_more = len(rows) > limit and offset + limit < MAX_SEARCH_OFFSET
+        return {
+            'query': query,
+            'results': [serialize_message(row) for row in rows[:limit]],
+            'ranked': ranked,
+            'has_more': has_more,
+            'next_offset': offset + limit if has_more else None,
+        }
+
+    @staticmethod
+    def _fts_rows(room_id: int, terms: List[str], offset: int, limit: int) -> List[Dict]:
+        messages = Message.objects.raw(
+            f"""
+            SELECT m.id, m.username, m.content, m.timestamp
+            FROM {SEARCH_TABLE} f
+            JOIN chat_message m ON m.id = f.rowid
+            WHERE {SEARCH_TABLE} MATCH %s
+            ORDER BY f.rank, f.rowid DESC
+            LIMIT %s OFFSET %s
+            """,
+            [build_match_expression(room_id, terms), limit, offset],
+        )
+        return [
+            {'id': m.id, 'username': m.username, 'content': m.content, 'timestamp': m.timestamp}
+            for m in messages
+        ]
+
+    @staticmethod
+    def _scan_rows(room_id: int, terms: List[str], offset: int, limit: int) -> List[Dict]:
+        queryset = Message.objects.filter(room_id=room_id)
+        for term in terms:
+            queryset = queryset.filter(content__icontains=term)
+        return list(
+            queryset.order_by('-timestamp', '-id')
+            .values('id', 'username', 'content', 'timestamp')[offset:offset + limit]
+        )
+
+
+def rebuild_search_index(batch_size: int = BACKFILL_BATCH_SIZE, optimize: bool = False,
+                         using: str = DEFAULT_DB_ALIAS, progress=None) -> int:
+    """Re-index every message in batches, without blocking writers for the whole run.
+
+    The index is emptied and the current highest id noted in one
+    transaction. From then on the triggers index new messages, and the
+    batches only cover ids up to that mark, so nothing is indexed twice.
+    Deleting old messages while this runs can leave stale index entries,
+    so avoid running it alongside retention pruning. Returns the number of
+    messages indexed.
+    """
+    connection = connections[using]
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('delete-all')")
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM chat_message")
+        high_water = cursor.fetchone()[0]
+
+    indexed = last_id = 0
+    while last_id < high_water:
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT MAX(id), COUNT(*) FROM (SELECT id FROM chat_message "
+                "WHERE id > %s AND id <= %s ORDER BY id LIMIT %s)",
+                [last_id, high_water, batch_size],
+            )
+            batch_end, count = cursor.fetchone()
+            if batch_end is None:
+                break
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE}(rowid, content, room_id) "
+                "SELECT id, content, room_id FROM chat_message WHERE id > %s AND id <= %s",
+                [last_id, batch_end],
+            )
+        last_id = batch_end
+        indexed += count
+        if progress:
+            progress(indexed, last_id, high_water)
+
+    if optimize:
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')")
+    return indexed
@@ -0,0 +1,353 @@
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+
+from .history import CATCHUP_OVERLAP_MS
+from .metrics import SUMMARY_LLM_SECONDS, SUMMARY_SECONDS, timed
+from .models import Message, Room, RoomSummary
+from .persistence import WRITE_FLUSH_INTERVAL, MessageIdAllocator, message_ids, message_writer
+
+logger = logging.getLogger(__name__)
+
+# Constants
+SUMMARY_WORKERS = getattr(settings, 'CHAT_SUMMARY_WORKERS', 2)
+SUMMARY_MAX_PENDING = getattr(settings, 'CHAT_SUMMARY_MAX_PENDING', 32)
+SUMMARY_JOB_TTL = 600  # 10 minutes
+SUMMARY_CHUNK_CHARS = getattr(settings, 'CHAT_SUMMARY_CHUNK_CHARS', 12000)
+SUMMARY_FETCH_SIZE = 500
+SUMMARY_MAP_WORKERS = getattr(settings, 'CHAT_SUMMARY_MAP_WORKERS', 4)
+SUMMARY_SETTLE_MS = getattr(settings, 'CHAT_SUMMARY_SETTLE_MS', None)  # default: see settle_window_ms
+
+try:
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    LANGCHAIN_AVAILABLE = True
+except ImportError:
+    logger.warning("Langchain dependencies not available. Chat summarization will be disabled.")
+    LANGCHAIN_AVAILABLE = False
+
+# Prompts
+SUMMARY_PROMPT = (
+    "Write a concise summary of the following group chat conversation:\n\n"
+    "{text}\n\n"
+    "CONCISE SUMMARY:"
+)
+MERGE_PROMPT = (
+    "Here is a summary of a group chat conversation so far:\n\n"
+    "{summary}\n\n"
+    "These messages were posted since that summary was written:\n\n"
+    "{text}\n\n"
+    "Rewrite the summary so it covers the whole conversation. Keep it concise.\n\n"
+    "CONCISE SUMMARY:"
+)
+REDUCE_PROMPT = (
+    "The following are summaries of consecutive parts of one group chat conversation:\n\n"
+    "{text}\n\n"
+    "Combine them into a single concise summary of the whole conversation.\n\n"
+    "CONCISE SUMMARY:"
+)
+
+
+class FakeSummaryLLM:
+    """Deterministic offline stand-in for the chat model, for tests and local runs.
+
+    Enable it with ``CHAT_SUMMARY_LLM = 'chat.summarizer.FakeSummaryLLM'``.
+    """
+
+    def __init__(self):
+        self.prompts = []
+
+    def invoke(self, prompt: str) -> str:
+        self.prompts.append(prompt)
+        body = prompt.rsplit("CONCISE SUMMARY:", 1)[0]
+        lines = [line for line in body.splitlines() if ': ' in line]
+        return f"{len(lines)} lines discussed; last: {lines[-1] if lines else 'nothing'}"
+
+
+def get_summary_llm():
+    """Build the LLM used for summaries, or None when none is configured."""
+    factory = getattr(settings, 'CHAT_SUMMARY_LLM', None)
+    if factory:
+        return import_string(factory)()
+
+    if not LANGCHAIN_AVAILABLE:
+        return None
+    return ChatGoogleGenerativeAI(
+        google_api_key=settings.GEMINI_API_KEY,
+        model="gemini-1.5-flash",
+        max_output_tokens=150,
+        temperature=0.3,
+        top_p=0.95
+    )
+
+
+def settle_window_ms() -> int:
+    """How long after its id is allocated a message may still be committed.
+
+    Another worker's write-behind queue can hold a message for a flush
+    interval, then wait out the database lock timeout (SQLite's busy
+    timeout) before its batch commits.
+    """
+    if SUMMARY_SETTLE_MS is not None:
+        return SUMMARY_SETTLE_MS
+    lock_timeout = settings.DATABASES['default'].get('OPTIONS', {}).get('timeout', 20)
+    return int((WRITE_FLUSH_INTERVAL + lock_timeout) * 1000) + CATCHUP_OVERLAP_MS
+
+
+def settled_message_id() -> int:
+    """An id below which every message has been committed, or never will be.
+
+    Ids are handed out before the write-behind queue stores them, and only
+    roughly in order across workers, so a lower id can still be committed
+    after a higher one. This process's own queue is checked directly;
+    other workers are covered by ``settle_window_ms``.
+    """
+    settled = MessageIdAllocator.rewind(message_ids.next_id(), settle_window_ms())
+    oldest_pending = message_writer.oldest_pending_id()
+    if oldest_pending is not None:
+        settled = min(settled, oldest_pending)
+    return settled
+
+
+@timed(SUMMARY_LLM_SECONDS)
+def complete(llm, prompt: str) -> str:
+    """Run a prompt through a LangChain chat model or a plain-string stand-in."""
+    result = llm.invoke(prompt)
+    return getattr(result, 'content', result).strip()
+
+
+def iter_message_chunks(queryset, max_chars: int = SUMMARY_CHUNK_CHARS) -> Iterator[Tuple[str, int, int]]:
+    """Stream messages as (text, last_message_id, message_count) chunks.
+
+    Rows come through a server-side cursor, so at most one chunk of chat
+    text is held in memory regardless of how long the history is.
+    """
+    lines: List[str] = []
+    size = 0
+    last_id = 0
+    rows = queryset.order_by('id').values_list('id', 'username', 'content')
+    for message_id, username, content in rows.iterator(chunk_size=SUMMARY_FETCH_SIZE):
+        line = f"{username}: {content}"
+        if lines and size + len(line) > max_chars:
+            yield "\n".join(lines), last_id, len(lines)
+            lines, size = [], 0
+        lines.append(line)
+        size += len(line) + 1
+        last_id = message_id
+    if lines:
+        yield "\n".join(lines), last_id, len(lines)
+
+
+def reduce_summaries(llm, summaries: List[str], max_chars: int = SUMMARY_CHUNK_CHARS) -> str:
+    """Fold partial summaries together level by level until one remains."""
+    while len(summaries) > 1:
+        groups: List[List[str]] = [[]]
+        size = 0
+        for summary in summaries:
+            if groups[-1] and size + len(summary) > max_chars:
+                groups.append([])
+                size = 0
+            groups[-1].append(summary)
+            size += len(summary)
+        if len(groups) == len(summaries):
+            # Every summary fills a group alone; pair them up to keep shrinking
+            groups = [summaries[i:i + 2] for i in range(0, len(summaries), 2)]
+        summaries = [
+            complete(llm, REDUCE_PROMPT.format(text="\n\n".join(group))) if len(group) > 1 else group[0]
+            for group in groups
+        ]
+    return summaries[0]
+
+
+def map_chunks(llm, chunks: Iterator[Tuple[str, int, int]],
+               workers: int = SUMMARY_MAP_WORKERS) -> Tuple[List[str], int, int]:
+    """Summarize chunks in parallel, keeping at most ``2 * workers`` chunks in flight.
+
+    Returns (partial summaries in chat order, last message id, message count).
+    """
+    partials: List[str] = []
+    last_id = count = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='summarizer-map') as executor:
+        in_flight = deque()
+        for text, chunk_last_id, chunk_count in chunks:
+            in_flight.append(executor.submit(complete, llm, SUMMARY_PROMPT.format(text=text)))
+            last_id = chunk_last_id
+            count += chunk_count
+            if len(in_flight) >= workers * 2:
+                partials.append(in_flight.popleft().result())
+        while in_flight:
+            partials.append(in_flight.popleft().result())
+    return partials, last_id, count
+
+
+class ChatSummarizer:
+    # Handles incremental chat summarization using Langchain and Gemini.
+    @staticmethod
+    def cached_summary(room_code: str) -> Optional[Dict]:
+        """Return the stored summary if no message has arrived since it was made."""
+        stored = RoomSummary.objects.filter(room__code=room_code).first()
+        if stored is None:
+            return None
+        if Message.objects.filter(room_id=stored.room_id, id__gt=stored.last_message_id).exists():
+            return None
+        return {'summary': stored.summary, 'cached': True, 'status': 200}
+
+    @staticmethod
+    def summarize_room_chat(room_code: str) -> Dict:
+        """Summarize a room, folding only messages newer than the stored summary."""
+        if not room_code:
+            return {'error': 'room_code is required', 'status': 400}
+
+        try:
+            room = Room.objects.get(code=room_code)
+        except Room.DoesNotExist:
+            return {'error': 'Room not found', 'status': 404}
+
+        stored: Optional[RoomSummary] = RoomSummary.objects.filter(room=room).first()
+        high_water_mark = stored.last_message_id if stored else 0
+        # Stop short of messages that may still be committed, so late writes
+        # land above the stored mark and the next run sees them
+        settled = settled_message_id()
+
+        chunks = iter_message_chunks(room.messages.filter(id__gt=high_water_mark, id__lt=settled))
+        first_chunk = next(chunks, None)
+        if first_chunk is None:
+            if stored:
+                return {'summary': stored.summary, 'cached': True, 'status': 200}
+            return {'error': 'No messages found for this room', 'status': 404}
+
+        llm = get_summary_llm()
+        if llm is None:
+            return {
+                'error': 'Chat summarization feature is not available',
+                'status': 503
+            }
+
+        try:
+            second_chunk = next(chunks, None)
+            if second_chunk is None:
+                # Everything new fits in one prompt
+                chat_text, last_id, new_count = first_chunk
+                if stored:
+                    prompt = MERGE_PROMPT.format(summary=stored.summary, text=chat_text)
+                else:
+                    prompt = SUMMARY_PROMPT.format(text=chat_text)
+                summary = complete(llm, prompt)
+            else:
+                # Map each chunk to a partial summary, then reduce them together
+                # with the previous summary, if any
+                remaining = (chunk for group in ((first_chunk, second_chunk), chunks) for chunk in group)
+                partials, last_id, new_count = map_chunks(llm, remaining)
+                if stored:
+                    partials.insert(0, stored.summary)
+                summary = reduce_summaries(llm, partials)
+
+            RoomSummary.objects.update_or_create(
+                room=room,
+                defaults={
+                    'summary': summary,
+                    'last_message_id': last_id,
+                    'message_count': (stored.message_count if stored else 0) + new_count,
+                }
+            )
+
+            logger.info(f"Summarized {new_count} new messages for room {room_code}")
+            return {'summary': summary, 'cached': False, 'status': 200}
+
+        except Exception as e:
+            logger.error(f"Error generating summary for room {room_code}: {e}")
+            return {'error': 'Failed to generate summary', 'status': 500}
+
+
+class SummaryJobQueue:
+    """Runs summaries on a bounded thread pool instead of request threads.
+
+    At most one job per room is queued or running at a time in this
+    process; further requests for that room get the existing job back.
+    Job state lives in the cache for the status endpoint, so with more than
+    one worker the cache must be shared (Redis when ``REDIS_URL`` is set) or
+    status requests reaching another worker get a 404. Results are also
+    pushed to the room's WebSocket group.
+    """
+
+    def __init__(self, workers: int = SUMMARY_WORKERS, max_pending: int = SUMMARY_MAX_PENDING):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='summarizer')
+        self._lock = threading.Lock()
+        self._active: Dict[str, Dict] = {}  # room_code -> job as submitted
+
+    @staticmethod
+    def _cache_key(job_id: str) -> str:
+        return f'summary_job_{job_id}'
+
+    @staticmethod
+    def get_job(job_id: str) -> Optional[Dict]:
+        return cache.get(SummaryJobQueue._cache_key(job_id))
+
+    def _save(self, job: Dict) -> None:
+        cache.set(self._cache_key(job['job_id']), job, timeout=SUMMARY_JOB_TTL)
+
+    def submit(self, room_code: str) -> Optional[Dict]:
+        """Queue a summary for ``room_code``; None when the queue is full."""
+        with self._lock:
+            # The job stays active until it finishes, even if its cache entry expired
+            active = self._active.get(room_code)
+            if active:
+                return self.get_job(active['job_id']) or active
+
+            if len(self._active) >= self.max_pending:
+                return None
+
+            job = {'job_id': uuid.uuid4().hex, 'room_code': room_code, 'state': 'queued'}
+            self._active[room_code] = job
+            self._save(job)
+
+        self._executor.submit(self._run, job)
+        return job
+
+    def _run(self, job: Dict) -> None:
+        room_code = job['room_code']
+        started = time.perf_counter()
+        close_old_connections()
+        try:
+            self._save({**job, 'state': 'running'})
+            result = ChatSummarizer.summarize_room_chat(room_code)
+        except Exception as e:
+            logger.error(f"Summary job {job['job_id']} for room {room_code} crashed: {e}")
+            result = {'error': 'Failed to generate summary', 'status': 500}
+        finally:
+            close_old_connections()
+            with self._lock:
+                self._active.pop(room_code, None)
+
+        status = result.pop('status', 200)
+        job = {**job, **result, 'state': 'done' if status == 200 else 'failed'}
+        SUMMARY_SECONDS.labels(job['state']).observe(time.perf_counter() - started)
+        self._save(job)
+        self._notify_room(job)
+
+    @staticmethod
+    def _notify_room(job: Dict) -> None:
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        try:
+            async_to_sync(channel_layer.group_send)(
+                f"chat_{job['room_code']}",
+                {'type': 'summary_result', 'job': job}
+            )
+        except Exception as e:
+            logger.error(f"Could not deliver summary job {job['job_id']} to room {job['room_code']}: {e}")
+
+
+summary_jobs = SummaryJobQueue()
@@ -0,0 +1,108 @@
+import threading
+import time
+from unittest import mock, skipUnless
+
+from django.test import SimpleTestCase
+
+from chat.presence import LocalSortedSetClient, SortedSetPresence
+
+try:
+    import fakeredis
+    FAKEREDIS_AVAILABLE = True
+except ImportError:
+    FAKEREDIS_AVAILABLE = False
+
+
+class PresenceTests:
+    """Run against both the in-process client and a Redis stand-in."""
+
+    def make_client(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.presence = SortedSetPresence(self.make_client(), timeout=300, connection_timeout=90)
+
+    def test_first_connection_joins_and_last_leaves(self):
+        self.assertTrue(self.presence.connect('ROOM', 'alice', 'tab-1'))
+        self.assertFalse(self.presence.connect('ROOM', 'alice', 'tab-2'))
+        self.assertFalse(self.presence.disconnect('ROOM', 'alice', 'tab-1'))
+        self.assertEqual(self.presence.online_users('ROOM'), ['alice'])
+        self.assertTrue(self.presence.disconnect('ROOM', 'alice', 'tab-2'))
+        self.assertEqual(self.presence.online_users('ROOM'), [])
+
+    def test_reconnecting_the_same_connection_is_not_a_second_join(self):
+        self.assertTrue(self.presence.connect('ROOM', 'alice', 'tab-1'))
+        self.assertTrue(self.presence.connect('ROOM', 'alice', 'tab-1'))
+        self.assertTrue(self.presence.disconnect('ROOM', 'alice', 'tab-1'))
+
+    def test_crashed_connection_stops_counting_after_timeout(self):
+        now = time.time()
+        with mock.patch('chat.presence.time.time', return_value=now):
+            self.presence.connect('ROOM', 'alice', 'crashed-worker')
+            self.presence.connect('ROOM', 'alice', 'tab-2')
+        # tab-2 keeps heartbeating; the crashed worker's connection never does
+        with mock.patch('chat.presence.time.time', return_value=now + 60):
+            self.presence.mark_online('ROOM', 'alice', 'tab-2')
+        with mock.patch('chat.presence.time.time', return_value=now + 120):
+            self.assertTrue(self.presence.disconnect('ROOM', 'alice', 'tab-2'))
+            self.assertEqual(self.presence.online_users('ROOM'), [])
+            self.assertTrue(self.presence.connect('ROOM', 'alice', 'tab-3'))
+
+    def test_concurrent_connects_and_disconnects_never_lose_a_live_user(self):
+        rounds, tabs = 50, 8
+        joined, left = [], []
+        start = threading.Barrier(tabs)
+
+        def churn(tab):
+            start.wait()
+            for index in range(rounds):
+                connection_id = f'tab-{tab}-{index}'
+                if self.presence.connect('ROOM', 'alice', connection_id):
+                    joined.append(connection_id)
+                if self.presence.disconnect('ROOM', 'alice', connection_id):
+                    left.append(connection_id)
+
+        # One connection stays open throughout, so alice must never leave
+        self.assertTrue(self.presence.connect('ROOM', 'alice', 'anchor'))
+        workers = [threading.Thread(target=churn, args=(tab,)) for tab in range(tabs)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual((joined, left), ([], []))
+        self.assertEqual(self.presence.online_users('ROOM'), ['alice'])
+        self.assertTrue(self.presence.disconnect('ROOM', 'alice', 'anchor'))
+
+    def test_concurrent_tabs_join_and_leave_exactly_once(self):
+        tabs = 16
+        results = []
+        start = threading.Barrier(tabs)
+
+        def open_tab(tab):
+            start.wait()
+            results.append(('connect', self.presence.connect('ROOM', 'alice', f'tab-{tab}')))
+
+        def close_tab(tab):
+            start.wait()
+            results.append(('disconnect', self.presence.disconnect('ROOM', 'alice', f'tab-{tab}')))
+
+        for target in (open_tab, close_tab):
+            workers = [threading.Thread(target=target, args=(tab,)) for tab in range(tabs)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        self.assertEqual(results.count(('connect', True)), 1)
+        self.assertEqual(results.count(('disconnect', True)), 1)
+        self.assertEqual(self.presence.online_users('ROOM'), [])
+
+
+class LocalPresenceTests(PresenceTests, SimpleTestCase):
+    def make_client(self):
+        return LocalSortedSetClient()
+
+
+@skipUnless(FAKEREDIS_AVAILABLE, "fakeredis is not installed")
+class RedisPresenceTests(PresenceTests, SimpleTestCase):
+    def make_client(self):
+        return fakeredis.FakeRedis(decode_responses=True)
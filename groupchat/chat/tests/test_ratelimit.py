@@ -0,0 +1,32 @@
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from chat.ratelimit import client_ip, request_ip, scope_ip
+
+
+class ClientIpTests(SimpleTestCase):
+    def test_forwarded_for_is_ignored_without_trusted_proxies(self):
+        self.assertEqual(client_ip('10.0.0.1', '203.0.113.7'), '10.0.0.1')
+
+    @override_settings(CHAT_TRUSTED_PROXY_COUNT=1)
+    def test_takes_the_address_our_proxy_saw(self):
+        # The client sent its own X-Forwarded-For; the proxy appended the real address
+        self.assertEqual(client_ip('10.0.0.1', '198.51.100.9, 203.0.113.7'), '203.0.113.7')
+
+    @override_settings(CHAT_TRUSTED_PROXY_COUNT=2)
+    def test_counts_hops_from_the_right(self):
+        self.assertEqual(client_ip('10.0.0.1', '198.51.100.9, 203.0.113.7, 10.0.0.2'), '203.0.113.7')
+        self.assertEqual(client_ip('10.0.0.1', '203.0.113.7'), '10.0.0.1')
+
+    @override_settings(CHAT_TRUSTED_PROXY_COUNT=1)
+    def test_http_request(self):
+        request = RequestFactory().get('/', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='203.0.113.7')
+        self.assertEqual(request_ip(request), '203.0.113.7')
+
+    @override_settings(CHAT_TRUSTED_PROXY_COUNT=1)
+    def test_websocket_scope(self):
+        scope = {
+            'client': ['10.0.0.1', 51000],
+            'headers': [(b'x-forwarded-for', b'198.51.100.9'), (b'x-forwarded-for', b'203.0.113.7')],
+        }
+        self.assertEqual(scope_ip(scope), '203.0.113.7')
+        self.assertEqual(scope_ip({'headers': []}), None)
@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from chat.models import ArchiveSegment, Message, Room
+from chat.persistence import message_ids
+
+
+class ReconcileRoomStatsTests(TestCase):
+    def reconcile(self, *args):
+        out = StringIO()
+        call_command('reconcile_room_stats', *args, stdout=out)
+        return out.getvalue()
+
+    def test_recounts_hot_and_archived_messages(self):
+        room = Room.objects.create(code='DRIFT', message_count=99)
+        archived_at = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        ArchiveSegment.objects.create(
+            room=room, path='DRIFT/1.jsonl.gz', first_id=1, last_id=2, first_timestamp=archived_at,
+            last_timestamp=archived_at, message_count=2, size_bytes=10,
+        )
+        latest = archived_at + timedelta(days=1)
+        Message.objects.create(id=message_ids.next_id(), room=room, username='alice', content='hi', timestamp=latest)
+
+        self.assertIn('found 1 with drift', self.reconcile('--dry-run'))
+        room.refresh_from_db()
+        self.assertEqual(room.message_count, 99)
+
+        self.assertIn('DRIFT: messages 99 -> 3', self.reconcile())
+        room.refresh_from_db()
+        self.assertEqual((room.message_count, room.last_message_at), (3, latest))
+        self.assertIn('fixed 0 with drift', self.reconcile())
@@ -0,0 +1,81 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from chat.models import Message, Room, RoomSummary
+from chat.persistence import MessageIdAllocator, message_ids, message_writer
+from chat.summarizer import (
+    MERGE_PROMPT, REDUCE_PROMPT, SUMMARY_PROMPT, ChatSummarizer, FakeSummaryLLM, settle_window_ms,
+)
+
+SETTLED_MS = 60 * 1000  # comfortably older than the settle window
+
+
+class SummarizerTests(TestCase):
+    def setUp(self):
+        self.room = Room.objects.create(code='SUMMARY', name='Summaries')
+        self.llm = FakeSummaryLLM()
+        patcher = mock.patch('chat.summarizer.get_summary_llm', return_value=self.llm)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, content, age_ms=SETTLED_MS):
+        message_id = MessageIdAllocator.rewind(message_ids.next_id(), settle_window_ms() + age_ms)
+        return Message.objects.create(id=message_id, room=self.room, username='alice', content=content)
+
+    def summarize(self):
+        return ChatSummarizer.summarize_room_chat(self.room.code)
+
+    def prompt_kinds(self):
+        kinds = []
+        for prompt in self.llm.prompts:
+            for name, template in (('summary', SUMMARY_PROMPT), ('merge', MERGE_PROMPT), ('reduce', REDUCE_PROMPT)):
+                if prompt.startswith(template.split('{', 1)[0]):
+                    kinds.append(name)
+        return kinds
+
+    def test_later_runs_merge_only_new_messages(self):
+        self.post('hello', age_ms=2 * SETTLED_MS)
+        first = self.summarize()
+        self.assertEqual(first['summary'], '1 lines discussed; last: alice: hello')
+
+        latest = self.post('goodbye')
+        self.llm.prompts.clear()
+        second = self.summarize()
+        self.assertFalse(second['cached'])
+        self.assertEqual(self.prompt_kinds(), ['merge'])
+        previous, new = self.llm.prompts[0].split('posted since that summary was written')
+        self.assertIn(first['summary'], previous)
+        self.assertIn('alice: goodbye', new)
+        self.assertNotIn('alice: hello', new)
+        stored = RoomSummary.objects.get(room=self.room)
+        self.assertEqual((stored.last_message_id, stored.message_count), (latest.id, 2))
+
+        self.llm.prompts.clear()
+        self.assertTrue(self.summarize()['cached'])
+        self.assertEqual(self.llm.prompts, [])
+
+    def test_long_history_is_mapped_in_chunks_then_reduced(self):
+        for index in range(30):
+            self.post(f'{index} ' + 'x' * 1000, age_ms=SETTLED_MS + 30 - index)
+        self.summarize()
+        kinds = self.prompt_kinds()
+        self.assertGreater(kinds.count('summary'), 1)
+        self.assertEqual(kinds[-1], 'reduce')
+        self.assertEqual(RoomSummary.objects.get(room=self.room).message_count, 30)
+
+    def test_messages_that_may_still_be_written_are_left_for_the_next_run(self):
+        settled = self.post('settled')
+        # Newer than the settle window: another worker may still commit older ids
+        self.post('recent', age_ms=-settle_window_ms() // 2)
+        self.summarize()
+        self.assertEqual(RoomSummary.objects.get(room=self.room).last_message_id, settled.id)
+
+    def test_stops_below_this_process_write_behind_queue(self):
+        settled = self.post('settled', age_ms=3 * SETTLED_MS)
+        queued = Message(id=MessageIdAllocator.rewind(message_ids.next_id(), settle_window_ms() + 2 * SETTLED_MS),
+                         room=self.room, username='alice', content='still queued')
+        self.post('committed after the queued one')
+        with mock.patch.object(message_writer, '_pending', [queued]):
+            self.summarize()
+        self.assertEqual(RoomSummary.objects.get(room=self.room).last_message_id, settled.id)
@@ -10,6 +10,12 @@ urlpatterns = [
     path('chat/<str:room_code>/', views.chat_room, name='chat_room'),
     path('browse-rooms/', views.browse_rooms, name='browse_rooms'),
     path('summarize/', views.summarize_chat, name='summarize_chat'),
+    path('summarize/status/<str:job_id>/', views.summary_status, name='summary_status'),
     path('update-user-activity/', views.update_user_activity, name='update_user_activity'),
+    path('room/<str:room_code>/info/', views.get_room_info, name='get_room_info'),
+    path('room/<str:room_code>/messages/', views.room_messages, name='room_messages'),
+    path('room/<str:room_code>/search/', views.search_messages, name='search_messages'),
+    path('room/<str:room_code>/export/', views.export_room, name='export_room'),
+    path('metrics', views.metrics, name='metrics'),
 
 ]
\ No newline at end of file
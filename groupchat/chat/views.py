@@ -1,114 +1,38 @@
 import random
 import string
 import logging
+import hmac
 import json
-from typing import Dict, List, Optional
+from typing import Optional
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods, require_GET, require_POST
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from django.core.cache import cache
 from django.conf import settings
 from django.db import transaction
 from django.core.paginator import Paginator
+from django.db.models import F
 from .models import Room, Message
-import time
+from .export import EXPORT_FORMATS, TranscriptExport
+from .history import MessageHistory
+from .metrics import CONTENT_TYPE, REGISTRY
+from .presence import OnlineUserTracker
+from .ratelimit import RateLimiter, request_ip
+from .search import MessageSearch
+from .summarizer import ChatSummarizer, SummaryJobQueue, summary_jobs
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
 # Constants
-ONLINE_USER_TIMEOUT = 300  # 5 minutes
 ROOM_CODE_LENGTH = 8
 MAX_ROOM_CODE_ATTEMPTS = 10
-CACHE_TIMEOUT = 300
 ROOMS_PER_PAGE = 10
 
 
-try:
-    from langchain_google_genai import ChatGoogleGenerativeAI
-    from langchain.chains.summarize import load_summarize_chain
-    from langchain.schema import Document
-    LANGCHAIN_AVAILABLE = True
-except ImportError:
-    logger.warning("Langchain dependencies not available. Chat summarization will be disabled.")
-    LANGCHAIN_AVAILABLE = False
-
-
-class OnlineUserTracker:
-    #Handles online user tracking with improved error handling and cleanup.
-    @staticmethod
-    def _get_cache_key(room_code: str) -> str:
-        return f'online_users_{room_code}'
-    
-    @staticmethod
-    def mark_user_online(room_code: str, username: str) -> bool:
-        """Mark a user as online in a specific room."""
-        try:
-            if not room_code or not username:
-                return False
-                
-            key = OnlineUserTracker._get_cache_key(room_code)
-            online_users = cache.get(key, {})
-            online_users[username] = time.time()
-            cache.set(key, online_users, timeout=CACHE_TIMEOUT)
-            return True
-        except Exception as e:
-            logger.error(f"Error marking user {username} online in room {room_code}: {e}")
-            return False
-    
-    @staticmethod
-    def get_online_users(room_code: str) -> List[str]:
-        """Get list of currently online users in a room."""
-        try:
-            if not room_code:
-                return []
-                
-            key = OnlineUserTracker._get_cache_key(room_code)
-            online_users = cache.get(key, {})
-            
-            if not online_users:
-                return []
-            
-            now = time.time()
-            # Remove inactive users
-            active_users = {
-                username: timestamp 
-                for username, timestamp in online_users.items() 
-                if now - timestamp < ONLINE_USER_TIMEOUT
-            }
-            
-            # Update cache with cleaned data
-            if len(active_users) != len(online_users):
-                cache.set(key, active_users, timeout=CACHE_TIMEOUT)
-            
-            return list(active_users.keys())
-        except Exception as e:
-            logger.error(f"Error getting online users for room {room_code}: {e}")
-            return []
-    
-    @staticmethod
-    def remove_user(room_code: str, username: str) -> bool:
-        """Remove a specific user from online tracking."""
-        try:
-            if not room_code or not username:
-                return False
-                
-            key = OnlineUserTracker._get_cache_key(room_code)
-            online_users = cache.get(key, {})
-            
-            if username in online_users:
-                del online_users[username]
-                cache.set(key, online_users, timeout=CACHE_TIMEOUT)
-            
-            return True
-        except Exception as e:
-            logger.error(f"Error removing user {username} from room {room_code}: {e}")
-            return False
-
-
 class RoomManager:
     """Handles room creation and management."""
     
@@ -137,7 +61,8 @@ class RoomManager:
                 
                 room = Room.objects.create(
                     code=code,
-                    name=room_name if room_name else "Untitled Room"
+                    name=room_name if room_name else "Untitled Room",
+                    member_count=1
                 )
                 user, created = User.objects.get_or_create(username=username)
                 room.users.add(user)
@@ -158,6 +83,7 @@ class RoomManager:
                 
                 if not room.users.filter(username=username).exists():
                     room.users.add(user)
+                    Room.objects.filter(pk=room.pk).update(member_count=F('member_count') + 1)
                 
                 logger.info(f"Added user {username} to room {room_code}")
                 return True
@@ -169,84 +95,47 @@ class RoomManager:
             return False
 
 
-class ChatSummarizer:
-    # Handles chat summarization using Langchain and Gemini.
-    @staticmethod
-    def summarize_room_chat(room_code: str) -> Dict:
-        """Summarize chat messages for a room."""
-        if not LANGCHAIN_AVAILABLE:
-            return {
-                'error': 'Chat summarization feature is not available',
-                'status': 503
-            }
-        
-        if not room_code:
-            return {'error': 'room_code is required', 'status': 400}
-        
-        try:
-            room = Room.objects.get(code=room_code)
-        except Room.DoesNotExist:
-            return {'error': 'Room not found', 'status': 404}
-        
-        messages = room.messages.order_by('timestamp')
-        if not messages.exists():
-            return {'error': 'No messages found for this room', 'status': 404}
-        
-        try:
-            # Prepare chat text
-            chat_text = "\n".join(
-                f"{msg.username}: {msg.content}" 
-                for msg in messages
-            )
-            
-            # Create Langchain Document
-            document = Document(page_content=chat_text)
-            
-            # Set up the LLM
-            llm = ChatGoogleGenerativeAI(
-                google_api_key=settings.GEMINI_API_KEY,
-                model="gemini-1.5-flash",
-                max_output_tokens=150,
-                temperature=0.3,
-                top_p=0.95
-            )
-            
-            chain = load_summarize_chain(llm, chain_type="stuff")
-            summary = chain.run([document])
-            
-            logger.info(f"Generated summary for room {room_code}")
-            return {'summary': summary.strip(), 'status': 200}
-            
-        except Exception as e:
-            logger.error(f"Error generating summary for room {room_code}: {e}")
-            return {'error': 'Failed to generate summary', 'status': 500}
+ROOM_ORDERINGS = {
+    'newest': ('-created_at',),
+    'active': (F('last_message_at').desc(nulls_last=True), '-created_at'),
+}
 
 
-# View Functions
-@require_GET
-def home(request):
-    """Render the home page with available rooms."""
-    # Get all public rooms with pagination
-    rooms = Room.objects.filter(is_public=True).order_by('-created_at')
-    
-    # Add online user count to each room
+def _paginated_public_rooms(request, sort: str = 'newest'):
+    """Paginate public rooms in the database and decorate only the visible page."""
+    rooms = Room.objects.filter(is_public=True).order_by(*ROOM_ORDERINGS[sort])
+
+    paginator = Paginator(rooms, ROOMS_PER_PAGE)
+    page_obj = paginator.get_page(request.GET.get('page'))
+
+    # One presence round trip for the whole page
+    page_rooms = list(page_obj.object_list)
+    online = OnlineUserTracker.get_online_users_bulk(room.code for room in page_rooms)
+
     rooms_with_online = []
-    for room in rooms:
-        online_users = OnlineUserTracker.get_online_users(room.code)
+    for room in page_rooms:
+        online_users = online.get(room.code, [])
         rooms_with_online.append({
             'room': room,
+            'member_count': room.member_count,
+            'message_count': room.message_count,
             'online_count': len(online_users),
-            'online_users': online_users
+            'online_users': online_users,
         })
-    
-    # Paginate rooms
-    paginator = Paginator(rooms_with_online, ROOMS_PER_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    
+    page_obj.object_list = rooms_with_online
+
+    return page_obj, paginator.count
+
+
+# View Functions
+@require_GET
+def home(request):
+    """Render the home page with available rooms."""
+    page_obj, total_rooms = _paginated_public_rooms(request)
+
     context = {
         'page_obj': page_obj,
-        'total_rooms': rooms.count()
+        'total_rooms': total_rooms
     }
     
     return render(request, 'chat/home.html', context)
@@ -273,6 +162,15 @@ def create_room(request):
             'error': 'Room name too long (max 200 characters)'
         })
     
+    # Throttle before any code probes or transactions hit the database
+    wait = RateLimiter.check_room_creation(request_ip(request))
+    if wait:
+        response = render(request, 'chat/home.html', {
+            'error': 'Too many rooms created. Please wait a moment and try again.'
+        }, status=429)
+        response['Retry-After'] = RateLimiter.retry_after(wait)
+        return response
+
     room = RoomManager.create_room_with_user(username, room_name)
     if not room:
         return render(request, 'chat/home.html', {
@@ -335,6 +233,7 @@ def chat_room(request, room_code):
     
     # Ensure user is added to room
     RoomManager.add_user_to_room(room_code, username)
+    room.refresh_from_db(fields=['member_count'])
     
     # Mark user as online
     OnlineUserTracker.mark_user_online(room_code, username)
@@ -344,7 +243,7 @@ def chat_room(request, room_code):
         'room_code': room_code,
         'room_name': room.get_display_name(),
         'username': username,
-        'user_count': room.users.count(),
+        'user_count': room.member_count,
         'online_users': online_users,
         'room_created': room.created_at,
     }
@@ -354,27 +253,15 @@ def chat_room(request, room_code):
 @require_GET
 def browse_rooms(request):
     """Browse all available public rooms."""
-    rooms = Room.objects.filter(is_public=True).order_by('-created_at')
-    
-    # Add online user count to each room
-    rooms_with_online = []
-    for room in rooms:
-        online_users = OnlineUserTracker.get_online_users(room.code)
-        rooms_with_online.append({
-            'room': room,
-            'online_count': len(online_users),
-            'online_users': online_users,
-            'message_count': room.messages.count()
-        })
-    
-    # Paginate rooms
-    paginator = Paginator(rooms_with_online, ROOMS_PER_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-    
+    sort = request.GET.get('sort', 'newest')
+    if sort not in ROOM_ORDERINGS:
+        sort = 'newest'
+    page_obj, total_rooms = _paginated_public_rooms(request, sort=sort)
+
     context = {
         'page_obj': page_obj,
-        'total_rooms': rooms.count()
+        'total_rooms': total_rooms,
+        'sort': sort
     }
     
     return render(request, 'chat/browse_rooms.html', context)
@@ -382,13 +269,33 @@ def browse_rooms(request):
 @csrf_exempt
 @require_GET
 def summarize_chat(request):
-    """Generate a summary of chat messages for a room."""
+    """Return an up-to-date summary, or start a background job to produce one."""
     room_code = request.GET.get('room_code', '').strip()
-    
-    result = ChatSummarizer.summarize_room_chat(room_code)
-    status = result.pop('status', 200)
-    
-    return JsonResponse(result, status=status)
+    if not room_code:
+        return JsonResponse({'error': 'room_code is required'}, status=400)
+    # Unknown rooms must not take a slot in the job queue
+    if not Room.objects.filter(code=room_code).exists():
+        return JsonResponse({'error': 'Room not found'}, status=404)
+
+    cached = ChatSummarizer.cached_summary(room_code)
+    if cached:
+        status = cached.pop('status', 200)
+        return JsonResponse(cached, status=status)
+
+    job = summary_jobs.submit(room_code)
+    if job is None:
+        return JsonResponse({'error': 'Too many summaries in progress, try again shortly'}, status=429)
+
+    return JsonResponse(job, status=202)
+
+
+@require_GET
+def summary_status(request, job_id):
+    """Report the state of a background summary job."""
+    job = SummaryJobQueue.get_job(job_id)
+    if job is None:
+        return JsonResponse({'error': 'Unknown or expired job'}, status=404)
+    return JsonResponse(job)
 
 
 @csrf_exempt
@@ -419,7 +326,7 @@ def get_room_info(request, room_code):
         
         return JsonResponse({
             'room_code': room.code,
-            'user_count': room.users.count(),
+            'user_count': room.member_count,
             'online_count': len(online_users),
             'online_users': online_users,
             'created_at': room.created_at.isoformat(),
@@ -429,6 +336,81 @@ def get_room_info(request, room_code):
         return JsonResponse({'error': 'Failed to get room information'}, status=500)
     
 
+@require_GET
+def room_messages(request, room_code):
+    """Page backwards through a room's message history."""
+    room = get_object_or_404(Room, code=room_code.upper())
+
+    try:
+        before = request.GET.get('before')
+        before = int(before) if before else None
+        limit = int(request.GET.get('limit') or 0)
+    except ValueError:
+        return JsonResponse({'error': 'before and limit must be integers'}, status=400)
+
+    page = MessageHistory.get_page(room.id, before=before, limit=limit)
+    return JsonResponse(page)
+
+
+@require_GET
+def search_messages(request, room_code):
+    """Ranked full-text search within a room's messages."""
+    room = get_object_or_404(Room, code=room_code.upper())
+
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return JsonResponse({'error': 'q is required'}, status=400)
+    try:
+        offset = int(request.GET.get('offset') or 0)
+        limit = int(request.GET.get('limit') or 0)
+    except ValueError:
+        return JsonResponse({'error': 'offset and limit must be integers'}, status=400)
+
+    return JsonResponse(MessageSearch.search(room.id, query, offset=offset, limit=limit))
+
+
+@require_GET
+def export_room(request, room_code):
+    """Stream a room's transcript as NDJSON or CSV, optionally gzipped."""
+    room = get_object_or_404(Room, code=room_code.upper())
+
+    fmt = request.GET.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return JsonResponse({'error': f"format must be one of {', '.join(EXPORT_FORMATS)}"}, status=400)
+    try:
+        since = request.GET.get('since')
+        since = int(since) if since else None
+    except ValueError:
+        return JsonResponse({'error': 'since must be a message id'}, status=400)
+    compress = request.GET.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+    export = TranscriptExport(room.id, fmt, since=since, compress=compress)
+    # Under ASGI a plain iterator would be read into memory before sending
+    content = export.achunks() if isinstance(request, ASGIRequest) else export.chunks()
+    response = StreamingHttpResponse(content, content_type=export.content_type)
+    response['Content-Disposition'] = f'attachment; filename="{export.filename(room.code)}"'
+    return response
+
+
+def _metrics_allowed(request) -> bool:
+    """True for scrapers holding METRICS_TOKEN as a bearer token, or calling from METRICS_ALLOWED_IPS."""
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        offered = request.headers.get('Authorization', '')
+        if hmac.compare_digest(offered.encode(), f'Bearer {token}'.encode()):
+            return True
+    allowed_ips = getattr(settings, 'METRICS_ALLOWED_IPS', ('127.0.0.1', '::1'))
+    return request_ip(request) in allowed_ips
+
+
+@require_GET
+def metrics(request):
+    """Expose this process's metrics in the Prometheus text format."""
+    if not _metrics_allowed(request):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
 def _parse_json_request(request) -> tuple:
     """Helper function to parse JSON request body."""
     try:
@@ -0,0 +1,80 @@
+"""Database profiles, chosen with the ``DATABASE_PROFILE`` environment variable.
+
+``sqlite`` (the default) tunes every connection for many writer threads:
+WAL journaling so readers never block the writer, ``synchronous=NORMAL``,
+a busy timeout instead of failing with "database is locked" at once, a
+memory-mapped read path, and ``BEGIN IMMEDIATE`` transactions so a
+transaction that starts by reading cannot deadlock when it then writes.
+
+``postgres`` keeps connections open between requests, one per thread. HTTP
+requests check them at the start and end of each request. WebSocket
+consumers and the write-behind queue reach the database through
+``database_sync_to_async``, which does the same check around every call.
+That is where dropped or expired connections are closed. Set
+``DATABASE_POOL_SIZE`` to share a psycopg connection pool instead. With
+the pool, the same checks hand each connection back after the call.
+"""
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+PROFILES = ('sqlite', 'postgres')
+
+
+# The environment is read when a profile is built, not at import, so
+# settings can load .env first.
+def sqlite_database(name, journal_mode: str = 'WAL', synchronous: Optional[str] = None,
+                    busy_timeout: Optional[float] = None, mmap_size: Optional[int] = None,
+                    transaction_mode: Optional[str] = 'IMMEDIATE') -> Dict:
+    if synchronous is None:
+        synchronous = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+    if busy_timeout is None:
+        busy_timeout = float(os.getenv('SQLITE_BUSY_TIMEOUT', 20))  # seconds
+    if mmap_size is None:
+        mmap_size = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    options = {
+        'timeout': busy_timeout,
+        # Runs on every new connection; journal_mode=WAL also persists in the file
+        'init_command': (
+            f'PRAGMA journal_mode={journal_mode};'
+            f'PRAGMA synchronous={synchronous};'
+            f'PRAGMA mmap_size={int(mmap_size)};'
+        ),
+    }
+    if transaction_mode:
+        options['transaction_mode'] = transaction_mode
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'OPTIONS': options,
+    }
+
+
+def postgres_database(name: Optional[str] = None, pool_size: Optional[int] = None) -> Dict:
+    pool_size = int(os.getenv('DATABASE_POOL_SIZE', 0)) if pool_size is None else pool_size
+    config = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': name or os.getenv('POSTGRES_DB', 'groupchat'),
+        'USER': os.getenv('POSTGRES_USER', 'groupchat'),
+        'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+        'HOST': os.getenv('POSTGRES_HOST', 'localhost'),
+        'PORT': os.getenv('POSTGRES_PORT', '5432'),
+        # Reopen connections the server has dropped instead of failing the next query
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
+    }
+    if pool_size:
+        # Django returns pooled connections on close, so they are not also kept alive
+        config['CONN_MAX_AGE'] = 0
+        config['OPTIONS']['pool'] = {'min_size': 1, 'max_size': pool_size, 'timeout': 10}
+    else:
+        config['CONN_MAX_AGE'] = int(os.getenv('DATABASE_CONN_MAX_AGE', 600))  # seconds
+    return config
+
+
+def database_profile(profile: str, base_dir: Path) -> Dict:
+    if profile == 'sqlite':
+        return sqlite_database(os.getenv('SQLITE_PATH', base_dir / 'db.sqlite3'))
+    if profile == 'postgres':
+        return postgres_database()
+    raise ValueError(f"Unknown DATABASE_PROFILE {profile!r}; expected one of {PROFILES}")
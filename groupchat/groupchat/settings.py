@@ -2,6 +2,8 @@ from pathlib import Path
 import os
 from dotenv import load_dotenv
 
+from .database import database_profile
+
 load_dotenv()
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -33,6 +35,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'chat.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -73,6 +76,39 @@ ASGI_APPLICATION = 'groupchat.asgi.application'
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
+# Online presence lives in Redis sorted sets when a URL is configured,
+# otherwise in an in-process stand-in (single worker / development only)
+PRESENCE_REDIS_URL = os.getenv("REDIS_URL")
+
+# Rate-limit buckets are shared between workers through the same Redis
+RATELIMIT_REDIS_URL = os.getenv("REDIS_URL")
+
+# Rate limits key on the client address. Behind N reverse proxies (one on
+# Render), that is the Nth X-Forwarded-For entry from the right.
+CHAT_TRUSTED_PROXY_COUNT = int(os.getenv("TRUSTED_PROXY_COUNT", 0))
+
+# Client message ids, so a retry reaching another worker is still recognised
+DEDUP_REDIS_URL = os.getenv("REDIS_URL")
+
+# Message ids embed a worker id that must differ between processes. Set it
+# per process, or let each process lease a free one through Redis.
+CHAT_WORKER_ID = os.getenv("CHAT_WORKER_ID")
+WORKER_ID_REDIS_URL = os.getenv("REDIS_URL")
+
+# Summary job status is read from the cache by whichever worker serves the
+# status request, so several workers need a shared cache
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv("REDIS_URL"),
+        }
+    }
+
+# /metrics answers scrapers from these addresses, or with "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_ALLOWED_IPS = [ip.strip() for ip in os.getenv("METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",") if ip.strip()]
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
 CORS_ALLOW_ALL_ORIGINS = False  # Set to True only for development if needed
 
 CORS_ALLOW_CREDENTIALS = True
@@ -99,11 +135,9 @@ CHANNEL_LAYERS = {
 }
 
 
+# 'sqlite' (tuned for concurrent writers) or 'postgres'; see groupchat/database.py
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': database_profile(os.getenv('DATABASE_PROFILE', 'sqlite'), BASE_DIR),
 }
 
 AUTH_PASSWORD_VALIDATORS = [